@@ -1,10 +1,3 @@
-class MovementPlan:
-    """
-    Define a movement plan.
-    """
-    def __init__(self, timeline = []):
-        self.timeline = timeline
+from voodoo.plan import MovementPlan
 
-if __name__ == "__main__":
-    import doctest
-    doctest.testmod(verbose=True)
+__all__ = ["MovementPlan"]
@@ -0,0 +1,222 @@
+"""
+Continuous acquisition with a bounded frame queue.
+
+Frames are copied from the poster into a fixed set of preallocated
+slots, so that a slow consumer never sees a frame overwritten and
+the queue never allocates. A frame overwritten in the poster while it
+was copied is discarded and counted as torn. When the queue is full, the policy decides
+what happens to a new frame:
+
+- BLOCK: the producer waits for the consumer,
+- DROP_OLDEST: the oldest queued frame is dropped,
+- DROP_NEWEST: the new frame is dropped,
+- LATEST: only the most recent frame is kept.
+
+>>> import numpy, voodoo.component.frames as frames
+>>> l = frames.layout(1, 1)
+>>> q = FrameQueue(l, 2, Policy.DROP_OLDEST)
+>>> for seq in range(4):
+...     q.put(frames.Frame(numpy.zeros(l.shape, numpy.uint8) + seq, seq, 0.))
+>>> [q.get().seq for i in range(2)]
+[2, 3]
+>>> s = q.stats()
+>>> (s['acquired'], s['delivered'], s['dropped'])
+(4, 2, 2)
+
+Closing the queue releases a blocked producer without dropping:
+
+>>> q = FrameQueue(l, 1, Policy.BLOCK)
+>>> q.put(frames.Frame(numpy.zeros(l.shape, numpy.uint8), 0, 0.))
+>>> t = threading.Timer(0.1, q.close)
+>>> t.start()
+>>> q.put(frames.Frame(numpy.zeros(l.shape, numpy.uint8), 1, 0.))
+>>> t.join()
+>>> q.stats()['dropped']
+0
+"""
+import collections, logging, threading, time
+
+import numpy
+
+import voodoo.util
+import voodoo.component.frames as frames
+
+Policy = voodoo.util.enum(('BLOCK', 'DROP_OLDEST', 'DROP_NEWEST', 'LATEST'))
+
+class Empty(Exception):
+    """Raised by FrameQueue.get when no frame came before the timeout."""
+    pass
+
+class FrameQueue:
+    """
+    Bounded queue of frames with a drop policy and counters.
+    It has a single consumer: a frame returned by get stays valid
+    until the next call to get.
+    """
+
+    def __init__(self, layout, maxsize=4, policy=Policy.DROP_OLDEST):
+        if policy == Policy.LATEST:
+            maxsize = 1
+        self.maxsize = maxsize
+        self.policy = policy
+        # Slots: the queued frames, one being written, one held
+        # by the consumer.
+        self.free = [numpy.empty(layout.shape, layout.dtype)
+                     for i in range(maxsize + 2)]
+        self.queue = collections.deque()
+        self.held = None
+        self.condition = threading.Condition()
+        self.closed = False
+        self.acquired = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.torn = 0
+        self.latency_sum = 0.
+        self.latency_max = 0.
+
+    def put(self, frame):
+        """Copy frame into the queue, applying the policy if it is full."""
+        self.condition.acquire()
+        try:
+            self.acquired += 1
+            while len(self.queue) >= self.maxsize:
+                if self.closed:
+                    # Not a drop: the queue no longer takes frames.
+                    return
+                if self.policy == Policy.BLOCK:
+                    self.condition.wait()
+                elif self.policy == Policy.DROP_NEWEST:
+                    self.dropped += 1
+                    return
+                else:
+                    self.free.append(self.queue.popleft()[0].image)
+                    self.dropped += 1
+            if self.closed:
+                return
+            slot = self.free.pop()
+        finally:
+            self.condition.release()
+        try:
+            copy = frames.copy_frame(frame, slot)
+        except frames.TornFrame:
+            copy = None
+        self.condition.acquire()
+        try:
+            if copy is None:
+                self.free.append(slot)
+                self.torn += 1
+                return
+            self.queue.append((copy, time.time()))
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def get(self, timeout=None):
+        """
+        Return the oldest queued frame. Raise Empty if there is none
+        after timeout seconds, or if the queue is closed and empty.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        self.condition.acquire()
+        try:
+            if self.held is not None:
+                self.free.append(self.held)
+                self.held = None
+            while not self.queue:
+                left = None if deadline is None else deadline - time.time()
+                if self.closed or (left is not None and left <= 0):
+                    raise Empty()
+                self.condition.wait(left)
+            (frame, queued) = self.queue.popleft()
+            latency = time.time() - queued
+            self.delivered += 1
+            self.latency_sum += latency
+            self.latency_max = max(self.latency_max, latency)
+            self.held = frame.image
+            self.condition.notifyAll()
+            return frame
+        finally:
+            self.condition.release()
+
+    def close(self):
+        self.condition.acquire()
+        try:
+            self.closed = True
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def stats(self):
+        """Return the frame counters and the queue latency (seconds)."""
+        self.condition.acquire()
+        try:
+            return {'acquired': self.acquired,
+                    'delivered': self.delivered,
+                    'dropped': self.dropped,
+                    'torn': self.torn,
+                    'queued': len(self.queue),
+                    'latency_mean': self.delivered and
+                        self.latency_sum / self.delivered or 0.,
+                    'latency_max': self.latency_max}
+        finally:
+            self.condition.release()
+
+
+class ContinuousAcquisition:
+    """
+    Acquire frames from an iterator (see Viam.iter_frames) in a
+    background thread and feed them to a FrameQueue, and to the
+    previews (see voodoo.component.preview) in self.previews.
+    """
+
+    def __init__(self, frame_iterator, layout, maxsize=4,
+                 policy=Policy.DROP_OLDEST):
+        self.logger = logging.getLogger('voodoo.component.acquisition')
+        self.frames = frame_iterator
+        self.layout = layout
+        self.queue = FrameQueue(layout, maxsize, policy)
+        self.running = True
+        self.error = None
+        self.previews = []
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            for frame in self.frames:
+                if not self.running:
+                    break
+                self.queue.put(frame)
+                for preview in list(self.previews):
+                    preview.offer(frame)
+        except Exception, e:
+            self.logger.error("acquisition failed: %s" % e)
+            self.error = e
+        finally:
+            self.queue.close()
+
+    def get(self, timeout=None):
+        return self.queue.get(timeout)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.queue.get()
+            except Empty:
+                return
+
+    def stats(self):
+        return self.queue.stats()
+
+    def stop(self):
+        """Stop the acquisition once the frame being acquired is done."""
+        self.running = False
+        self.queue.close()
+        self.thread.join()
+
+__all__ = ["ContinuousAcquisition", "Empty", "FrameQueue", "Policy"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -0,0 +1,169 @@
+"""
+Per-frame processing in a pool of worker processes.
+
+Frames are copied into slots of a shared memory area allocated before
+the workers are forked: a worker only receives the index of the slot
+(and the frame sequence number and timestamp), and sees the pixels as
+a numpy view on the slot, so nothing is pickled but the results.
+Slots are recycled once their result is back, and results are
+delivered in the order of the frames.
+
+Workers are forked, and a fork only copies the calling thread: a lock
+held by another thread at that time (dispatchers, pose streams, the
+log pump...) stays locked forever in the workers. Create the pool
+before any thread starts, typically at the start of the program, and
+keep it for every acquisition (see Viam.process). Creating it later
+logs a warning.
+
+>>> import numpy, voodoo.component.frames as frames
+>>> l = frames.layout(1, 1)
+>>> images = [frames.Frame(numpy.zeros(l.shape, numpy.uint8) + i, i, 0.)
+...           for i in range(6)]
+>>> pool = FramePool(l, lambda f: (f.seq, int(f.image.max())), 2, slots=3)
+>>> list(pool.imap(images))
+[(0, 0), (1, 1), (2, 2), (3, 3), (4, 4), (5, 5)]
+>>> pool.close()
+>>> import os
+>>> pool = FramePool(l, lambda f: os._exit(1), 1)
+>>> list(pool.imap(images))                   #doctest: +ELLIPSIS
+Traceback (most recent call last):
+...
+Exception: frame pool worker ... died (exit code 1)
+"""
+import logging, multiprocessing, Queue, threading, traceback
+
+import numpy
+
+import voodoo.component.frames as frames
+from voodoo.component.frames import TornFrame, copy_frame
+
+def _slot_views(memory, layout, count):
+    data = numpy.frombuffer(memory, numpy.uint8)
+    return [data[i * layout.nbytes:(i + 1) * layout.nbytes]
+            .view(layout.dtype).reshape(layout.shape) for i in range(count)]
+
+def _worker(function, memory, layout, count, tasks, results):
+    views = _slot_views(memory, layout, count)
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        (task_id, slot, seq, timestamp) = task
+        try:
+            res = (task_id, slot, True,
+                   function(frames.Frame(views[slot], seq, timestamp)))
+        except Exception:
+            res = (task_id, slot, False, traceback.format_exc())
+        results.put(res)
+
+
+class FramePool:
+    """
+    Apply function to frames in worker processes. function is called
+    with a frame whose image is only valid during the call, and must
+    return a picklable result.
+    """
+
+    def __init__(self, layout, function, processes=None, slots=None):
+        self.logger = logging.getLogger('voodoo.component.frame_pool')
+        if threading.active_count() > 1:
+            self.logger.warning("frame pool forked while %d threads run: "
+                                "workers may deadlock on their locks"
+                                % (threading.active_count() - 1))
+        processes = processes or multiprocessing.cpu_count()
+        # Enough slots to keep every worker busy while results travel.
+        slots = slots or 2 * processes
+        self.layout = layout
+        self.memory = multiprocessing.RawArray('B', layout.nbytes * slots)
+        self.slots = _slot_views(self.memory, layout, slots)
+        self.free = range(slots)
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(
+            target=_worker, args=(function, self.memory, layout, slots,
+                                  self.tasks, self.results))
+                        for i in range(processes)]
+        for w in self.workers:
+            w.daemon = True
+            w.start()
+        self.submitted = 0
+        self.processed = 0
+        # Frames overwritten in their poster while copied, skipped.
+        self.torn = 0
+
+    def _collect(self, done):
+        while True:
+            try:
+                (task_id, slot, ok, res) = self.results.get(timeout=0.5)
+                break
+            except Queue.Empty:
+                # A worker killed (e.g. by a crash in native code)
+                # never sends the result of its frame.
+                for w in self.workers:
+                    if not w.is_alive():
+                        raise Exception("frame pool worker %d died "
+                                        "(exit code %s)"
+                                        % (w.pid, w.exitcode))
+        # The result is a copy: the slot can be reused right away.
+        self.free.append(slot)
+        done[task_id] = (ok, res)
+
+    def imap(self, frames):
+        """
+        Process the frames of an iterator and yield the results in
+        order. Raise an exception if processing a frame failed.
+        """
+        # Identifiers of the frames in flight, in frame order.
+        pending = []
+        done = {}
+        frames = iter(frames)
+        exhausted = False
+        try:
+            while not exhausted or pending:
+                if pending and pending[0] in done:
+                    (ok, res) = done.pop(pending.pop(0))
+                    if not ok:
+                        raise Exception("frame processing failed:\n%s" % res)
+                    self.processed += 1
+                    yield res
+                elif not exhausted and self.free:
+                    frame = next(frames, None)
+                    if frame is None:
+                        exhausted = True
+                        continue
+                    slot = self.free.pop()
+                    try:
+                        copy_frame(frame, self.slots[slot])
+                    except TornFrame:
+                        self.free.append(slot)
+                        self.torn += 1
+                        continue
+                    self.tasks.put((self.submitted, slot, frame.seq,
+                                    frame.timestamp))
+                    pending.append(self.submitted)
+                    self.submitted += 1
+                else:
+                    self._collect(done)
+        finally:
+            # Wait for the frames in flight, so that their slots are
+            # free again.
+            while len(done) < len(pending):
+                self._collect(done)
+
+    def close(self):
+        for w in self.workers:
+            self.tasks.put(None)
+        for w in self.workers:
+            w.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+__all__ = ["FramePool"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -0,0 +1,195 @@
+"""
+Zero-copy access to Viam images from Python.
+
+An image poster is a shared memory area made of a header followed by
+the pixels. The header holds the frame version, its timestamp and its
+geometry::
+
+    uint64  version
+    float64 timestamp (seconds)
+    uint32  width, height, format, reserved
+
+The version is a sequence lock: the writer makes it odd before it
+updates the frame and sets it to twice the frame sequence number once
+the frame is complete.
+
+Frames are numpy views on the poster memory: nothing is copied, so a
+frame must be copied by the consumer if it is kept after the poster
+has been updated. copy_frame copies a frame and raises TornFrame if
+the poster was updated meanwhile.
+
+>>> l = layout(4, 1)    # HwSize._640x480, HwFmt.MONO8
+>>> (l.shape, l.dtype.name, l.nbytes)
+((480, 640), 'uint8', 307200)
+>>> buf = bytearray(HEADER.itemsize + l.nbytes)
+>>> write_frame(buf, l, 7, 1.5, numpy.ones(l.shape, numpy.uint8))
+>>> f = read_frame(buf, l)
+>>> (f.seq, f.timestamp, int(f.image.sum()))
+(7, 1.5, 307200)
+>>> out = numpy.empty(l.shape, l.dtype)
+>>> copy_frame(f, out).seq
+7
+>>> write_frame(buf, l, 8, 1.6, numpy.zeros(l.shape, numpy.uint8))
+>>> copy_frame(f, out)
+Traceback (most recent call last):
+TornFrame: frame 7 was overwritten while copied
+"""
+import mmap, os
+
+import numpy
+
+# Indexed by voodoo.component.viam_component.HwSize values.
+HW_SIZES = {
+    1: (160, 120),
+    2: (320, 240),
+    3: (512, 384),
+    4: (640, 480),
+    5: (800, 600),
+    6: (1024, 768),
+    7: (1280, 960),
+    8: (1600, 1200)
+    }
+
+# Indexed by voodoo.component.viam_component.HwFmt values:
+# (channels, dtype), channels may be fractional for packed formats.
+HW_FORMATS = {
+    1: (1, numpy.uint8),      # MONO8
+    2: (1, numpy.uint16),     # MONO16
+    3: (1.5, numpy.uint8),    # YUV411
+    4: (2, numpy.uint8),      # YUV422
+    5: (3, numpy.uint8),      # YUV444
+    6: (3, numpy.uint8)       # RGB888
+    }
+
+HEADER = numpy.dtype([('version', '<u8'), ('timestamp', '<f8'),
+                      ('width', '<u4'), ('height', '<u4'),
+                      ('format', '<u4'), ('reserved', '<u4')])
+
+class Layout:
+    """Memory layout of the pixels of a frame."""
+    def __init__(self, width, height, format):
+        if format not in HW_FORMATS:
+            raise ValueError("unsupported image format %s" % format)
+        (channels, dtype) = HW_FORMATS[format]
+        self.width = width
+        self.height = height
+        self.format = format
+        self.dtype = numpy.dtype(dtype)
+        if channels == 1:
+            self.shape = (height, width)
+        elif channels == int(channels):
+            self.shape = (height, width, int(channels))
+        else:
+            # Packed formats are exposed as raw bytes.
+            self.shape = (int(height * width * channels),)
+        self.nbytes = int(numpy.prod(self.shape)) * self.dtype.itemsize
+
+def layout(size, format):
+    """Return the layout of frames of a HwSize and a HwFmt."""
+    if size not in HW_SIZES:
+        raise ValueError("unsupported image size %s" % size)
+    (width, height) = HW_SIZES[size]
+    return Layout(width, height, format)
+
+
+class TornFrame(Exception):
+    """Raised by copy_frame when the poster changed during the copy."""
+    pass
+
+class Frame(object):
+    """
+    A frame: a view on the pixels, its sequence number and timestamp.
+    A frame read from a poster also holds the poster and the version
+    read with it (see copy_frame).
+    """
+    __slots__ = ('image', 'seq', 'timestamp', 'poster', 'version')
+
+    def __init__(self, image, seq, timestamp, poster=None, version=None):
+        self.image = image
+        self.seq = seq
+        self.timestamp = timestamp
+        self.poster = poster
+        self.version = version
+
+
+def open_poster(path, size=None):
+    """Map the image poster exported at path, read-only."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return mmap.mmap(fd, size or 0, mmap.MAP_SHARED, mmap.PROT_READ)
+    finally:
+        os.close(fd)
+
+def read_frame(buffer, layout):
+    """
+    Return the frame currently held by buffer (an image poster),
+    without copying the pixels.
+    """
+    header = numpy.frombuffer(buffer, HEADER, 1)
+    version = int(header['version'][0])
+    timestamp = float(header['timestamp'][0])
+    if (header['width'][0], header['height'][0], header['format'][0]) != \
+            (layout.width, layout.height, layout.format):
+        raise ValueError("poster holds %dx%d images of format %d"
+                         % (header['width'][0], header['height'][0],
+                            header['format'][0]))
+    image = numpy.frombuffer(buffer, layout.dtype,
+                             layout.nbytes // layout.dtype.itemsize,
+                             HEADER.itemsize).reshape(layout.shape)
+    return Frame(image, version >> 1, timestamp, header, version)
+
+def copy_frame(frame, out):
+    """
+    Copy the pixels of frame into out (an array of the frame layout)
+    and return the copied frame. For a frame read from a poster, raise
+    TornFrame if the writer was updating the frame when it was read,
+    or updated the poster before the copy completed: out then holds
+    a mix of two frames.
+    """
+    numpy.copyto(out, frame.image)
+    if frame.poster is not None and \
+            (frame.version & 1 or
+             int(frame.poster['version'][0]) != frame.version):
+        raise TornFrame("frame %d was overwritten while copied" % frame.seq)
+    return Frame(out, frame.seq, frame.timestamp)
+
+def write_frame(buffer, layout, seq, timestamp, image):
+    """Write a frame into a writable buffer laid out as a poster."""
+    header = numpy.frombuffer(buffer, HEADER, 1)
+    # Odd while the frame is updated, see copy_frame.
+    header['version'] |= 1
+    header['width'] = layout.width
+    header['height'] = layout.height
+    header['format'] = layout.format
+    pixels = numpy.frombuffer(buffer, layout.dtype,
+                              layout.nbytes // layout.dtype.itemsize,
+                              HEADER.itemsize).reshape(layout.shape)
+    pixels[...] = image
+    header['timestamp'] = timestamp
+    header['version'] = seq << 1
+
+def iter_frames(buffer, layout, wait, count=None):
+    """
+    Yield the frames of a poster. wait is called before each frame
+    and must return once a new frame is available (typically by
+    triggering an acquisition). Frames whose sequence number did not
+    change are skipped.
+    """
+    last = None
+    n = 0
+    while count is None or n < count:
+        wait()
+        frame = read_frame(buffer, layout)
+        if frame.seq == last:
+            continue
+        last = frame.seq
+        n += 1
+        yield frame
+
+__all__ = ["Frame", "Layout", "HEADER", "TornFrame", "copy_frame",
+           "iter_frames", "layout", "open_poster", "read_frame",
+           "write_frame"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
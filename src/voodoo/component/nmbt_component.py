@@ -1,34 +1,64 @@
-import logging, os, time, unittest
+import logging, os, threading, unittest
 
 import nmbt as _nmbt
 
-def make_nmbt_init_data(environment_path, bank, image, tracker_count):
+import voodoo.component.poses as poses
+import voodoo.util.dispatcher as dispatcher
+import voodoo.util.lru as lru
+
+# Reusable request templates (see voodoo.util.lru), one set per
+# thread. Returned objects are reused and must not be modified by
+# callers.
+_templates = lru.RequestTemplates(64)
+
+def _new_nmbt_init_data(environment_path, bank, image):
     arg = _nmbt.NmbtInitData()
     arg.defaultDirectory = environment_path
     arg.imageBank = bank
     arg.cameraName = image # FIXME: oops, wrong field name.
-    arg.maxTrackers = tracker_count
     return arg
 
-def make_nmbt_tracker_init_data(tracker_id, model_name, env_tracker_id):
+def _fill_nmbt_init_data(arg, tracker_count):
+    arg.maxTrackers = tracker_count
+
+def make_nmbt_init_data(environment_path, bank, image, tracker_count):
+    return _templates.request('init', (environment_path, bank, image),
+                              _new_nmbt_init_data, (tracker_count,),
+                              _fill_nmbt_init_data)
+
+def _new_nmbt_tracker_init_data(tracker_id):
     arg = _nmbt.NmbtTrackerInitData()
     arg.tracker_id = tracker_id
+    return arg
+
+def _fill_nmbt_tracker_init_data(arg, model_name, env_tracker_id):
     arg.model_name = model_name
     arg.env_tracker_id = env_tracker_id
-    return arg
+
+def make_nmbt_tracker_init_data(tracker_id, model_name, env_tracker_id):
+    return _templates.request('tracker', (tracker_id,),
+                              _new_nmbt_tracker_init_data,
+                              (model_name, env_tracker_id),
+                              _fill_nmbt_tracker_init_data)
 
 class Nmbt:
+    ready_timeout = 30.
+
     def __init__(self, genom):
         self.genom = genom
         self.logger = logging.getLogger('voodoo.component.nmbt')
+        self.dispatcher = None
+        # Guards the creation of the dispatcher by concurrent submits.
+        self.dispatcher_lock = threading.Lock()
+        self.environment_path = None
+        self.tracker_count = None
+        self.trackers = {}
+        self.poses = None
 
     def __enter__(self):
-        import voodoo.middleware.genom as genom
         self.start()
 
-        # Wait for the component to start.
-        while not genom.module_ready('nmbt'):
-            time.sleep(0.1)
+        self.genom.wait_ready('nmbt', self.ready_timeout)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -38,18 +68,102 @@ class Nmbt:
     def start(self):
         self.genom.startComponent('nmbt')
 
+    def submit(self, method, *args, **kwargs):
+        """
+        Call method (a method name) asynchronously and return a
+        voodoo.util.dispatcher.Future. Requests to this component run
+        in submission order, concurrently with requests to other
+        components. The keyword argument deadline (seconds) fails the
+        request if it did not start in time.
+        """
+        with self.dispatcher_lock:
+            if self.dispatcher is None:
+                self.dispatcher = dispatcher.Dispatcher('nmbt')
+            d = self.dispatcher
+        return d.submit(getattr(self, method), *args, **kwargs)
+
+    def latency_stats(self):
+        """Return the latency summary of each kind of submitted request."""
+        return self.dispatcher and self.dispatcher.stats() or {}
+
     def stop(self):
+        self.stop_pose_stream()
+        with self.dispatcher_lock:
+            (d, self.dispatcher) = (self.dispatcher, None)
+        if d:
+            d.stop()
         self.genom.stopComponent('nmbt')
 
     def init(self, environment_path, bank, image, tracker_count):
         self.logger.info("initialize module")
         arg = make_nmbt_init_data(environment_path, bank, image, tracker_count)
         _nmbt.Init(arg)
+        self.environment_path = environment_path
+        self.tracker_count = tracker_count
+        self.trackers = {}
 
     def init_tracker_from_file(self, tracker_id, model_name, env_tracker_id):
         self.logger.info("initialize tracker from file")
         arg = make_nmbt_tracker_init_data(tracker_id, model_name, env_tracker_id)
         _nmbt.InitTrackerFomrFile(arg)
+        self.trackers[tracker_id] = (model_name, env_tracker_id)
+
+    def init_trackers(self, trackers):
+        """
+        Initialize several trackers, given as a list of (tracker_id,
+        model_name, env_tracker_id), with one InitTrackerFomrFile
+        call per tracker. The batch is checked first, so that a bad
+        batch fails before any tracker is set up: model names given
+        as absolute paths must be existing files, other names are
+        resolved by the component. Submit it (see submit) to
+        initialize trackers without blocking.
+        """
+        trackers = list(trackers)
+        if self.tracker_count is not None and \
+                len(trackers) > self.tracker_count:
+            raise Exception("%d trackers requested, at most %d"
+                            % (len(trackers), self.tracker_count))
+        ids = [t[0] for t in trackers]
+        if len(set(ids)) != len(ids):
+            raise Exception("duplicate tracker ids in %s" % ids)
+        missing = [t[1] for t in trackers
+                   if os.path.isabs(t[1]) and not os.path.isfile(t[1])]
+        if missing:
+            raise Exception("missing model(s): %s" % ", ".join(missing))
+        self.logger.info("initialize %d tracker(s)" % len(trackers))
+        for (tracker_id, model_name, env_tracker_id) in trackers:
+            arg = make_nmbt_tracker_init_data(tracker_id, model_name,
+                                              env_tracker_id)
+            _nmbt.InitTrackerFomrFile(arg)
+            self.trackers[tracker_id] = (model_name, env_tracker_id)
+
+    def reinit_tracker(self, tracker_id):
+        """Initialize a tracker again with its model, e.g. once lost."""
+        (model_name, env_tracker_id) = self.trackers[tracker_id]
+        self.init_trackers([(tracker_id, model_name, env_tracker_id)])
+
+    def start_pose_stream(self, reader, capacity=1024, rate=30.):
+        """
+        Poll the poses of the trackers rate times per second into a
+        ring buffer of capacity poses (see voodoo.component.poses).
+        reader(batch) fills batch, an array of poses.POSE with one
+        record per tracker, with the current poses, e.g. from the
+        tracker poster. Query the returned stream with latest and
+        window.
+        """
+        if self.tracker_count is None:
+            raise Exception("nmbt is not initialized")
+        self.stop_pose_stream()
+        self.logger.info("start pose stream at %g Hz" % rate)
+        self.poses = poses.PoseStream(reader, self.tracker_count, capacity,
+                                      rate)
+        return self.poses
+
+    def stop_pose_stream(self):
+        if self.poses:
+            self.logger.info("stop pose stream")
+            self.poses.stop()
+            self.poses = None
 
 
 class basicTest(unittest.TestCase):
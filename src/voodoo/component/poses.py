@@ -0,0 +1,182 @@
+"""
+Streaming tracker poses into a preallocated ring buffer.
+
+Poses are records of a structured numpy type (tracker id, sequence
+number, timestamp, 6-DoF pose as x, y, z, roll, pitch, yaw, and
+confidence). A reader fills a preallocated batch with the current
+pose of every tracker; records whose sequence number did not change
+are discarded and the others are copied into the ring, so polling
+allocates no Python object per sample. Queries are vectorized.
+
+>>> ring = PoseRing(4, trackers=2)
+>>> batch = numpy.zeros(2, POSE)
+>>> batch['tracker'] = [0, 1]
+>>> batch['seq'] = [1, 1]
+>>> batch['timestamp'] = [0.1, 0.1]
+>>> ring.push(batch)
+2
+>>> ring.push(batch)            # unchanged sequence numbers
+0
+>>> batch['seq'][1] = 2
+>>> batch['timestamp'][1] = 0.2
+>>> batch['pose'][1] = [1, 2, 3, 0, 0, 0]
+>>> ring.push(batch)
+1
+>>> ring.latest()['pose'][1].tolist()
+[1.0, 2.0, 3.0, 0.0, 0.0, 0.0]
+>>> ring.window(0.15, 1.)['tracker'].tolist()
+[1]
+
+The latest pose of a tracker is kept even once the ring wrapped over
+it:
+
+>>> for seq in (4, 5, 6):
+...     batch['seq'][1] = seq
+...     n = ring.push(batch)
+>>> ring.latest()[['seq', 'timestamp']].tolist()
+[(1L, 0.1), (6L, 0.2)]
+"""
+import logging, threading, time
+
+import numpy
+
+POSE = numpy.dtype([('tracker', '<i4'), ('seq', '<u8'), ('timestamp', '<f8'),
+                    ('pose', '<f8', (6,)), ('confidence', '<f4')])
+
+class PoseRing:
+    """Ring buffer of the last capacity poses of trackers 0 to trackers - 1."""
+
+    def __init__(self, capacity, trackers):
+        self.records = numpy.zeros(capacity, POSE)
+        self.capacity = capacity
+        # Number of records ever written.
+        self.written = 0
+        self.last_seq = numpy.zeros(trackers, numpy.uint64)
+        self.seen = numpy.zeros(trackers, bool)
+        # Latest record of each tracker, kept apart from the ring, whose
+        # slots are overwritten by the records of other trackers.
+        self.latest_records = numpy.zeros(trackers, POSE)
+        self.lock = threading.Lock()
+
+    def push(self, batch):
+        """
+        Add the records of batch (an array of POSE) whose sequence
+        number changed. Return the number of records added.
+        """
+        trackers = batch['tracker']
+        changed = ~self.seen[trackers] | \
+            (batch['seq'] != self.last_seq[trackers])
+        n = int(numpy.count_nonzero(changed))
+        if not n:
+            return 0
+        if n > self.capacity:
+            raise ValueError("batch of %d records exceeds capacity %d"
+                             % (n, self.capacity))
+        new = batch[changed]
+        with self.lock:
+            positions = (self.written + numpy.arange(n)) % self.capacity
+            self.records[positions] = new
+            self.written += n
+            self.last_seq[new['tracker']] = new['seq']
+            self.seen[new['tracker']] = True
+            self.latest_records[new['tracker']] = new
+        return n
+
+    def valid(self):
+        """Return a copy of the records held, oldest first."""
+        with self.lock:
+            if self.written <= self.capacity:
+                return self.records[:self.written].copy()
+            start = self.written % self.capacity
+            return numpy.concatenate((self.records[start:],
+                                      self.records[:start]))
+
+    def latest(self):
+        """
+        Return the latest record of every tracker, indexed by tracker.
+        Trackers without pose have a zero sequence number.
+        """
+        with self.lock:
+            res = self.latest_records.copy()
+        res['tracker'] = numpy.arange(len(res))
+        return res
+
+    def window(self, start, stop, tracker=None):
+        """
+        Return the records stamped in [start, stop), of tracker
+        or of every tracker, in timestamp order.
+        """
+        records = self.valid()
+        mask = (records['timestamp'] >= start) & (records['timestamp'] < stop)
+        if tracker is not None:
+            mask &= records['tracker'] == tracker
+        res = records[mask]
+        return res[numpy.argsort(res['timestamp'], kind='mergesort')]
+
+
+class PoseStream:
+    """
+    Poll the poses of trackers at a given rate in a background thread.
+    reader is called with a preallocated array of POSE holding one
+    record per tracker, with tracker ids set, and must fill the other
+    fields in place with the current pose of each tracker.
+    """
+
+    def __init__(self, reader, trackers, capacity=1024, rate=30.):
+        self.logger = logging.getLogger('voodoo.component.poses')
+        self.reader = reader
+        self.ring = PoseRing(capacity, trackers)
+        self.batch = numpy.zeros(trackers, POSE)
+        self.period = 1. / rate
+        self.polls = 0
+        self.updates = 0
+        self.running = True
+        self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def poll(self):
+        """Read the poses once. Return the number of new poses."""
+        self.batch['tracker'] = numpy.arange(len(self.batch))
+        self.reader(self.batch)
+        self.polls += 1
+        n = self.ring.push(self.batch)
+        self.updates += n
+        return n
+
+    def _run(self):
+        deadline = time.time()
+        try:
+            while self.running:
+                self.poll()
+                deadline += self.period
+                delay = deadline - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Late: skip the missed periods.
+                    deadline = time.time()
+        except Exception, e:
+            self.logger.error("pose stream failed: %s" % e)
+            self.error = e
+
+    def latest(self):
+        return self.ring.latest()
+
+    def window(self, start, stop, tracker=None):
+        return self.ring.window(start, stop, tracker)
+
+    def stats(self):
+        return {'polls': self.polls, 'updates': self.updates,
+                'written': self.ring.written}
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+__all__ = ["POSE", "PoseRing", "PoseStream"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
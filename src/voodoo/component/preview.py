@@ -0,0 +1,173 @@
+"""
+Decimated, rate-limited preview of a frame stream.
+
+The acquisition thread only offers frames to the preview: unless a
+thumbnail is due and the preview worker is idle, offering a frame costs
+a time check. Due frames are copied into a staging buffer, and the
+worker downscales them (box averaging or stride sampling) and hands
+the thumbnails to its subscribers. A slow worker or subscriber skips
+frames, it never slows down the acquisition.
+
+>>> import numpy, voodoo.component.frames as frames
+>>> decimate(numpy.arange(16, dtype=numpy.uint8).reshape(4, 4), 2, 'box')
+array([[ 3,  5],
+       [11, 13]], dtype=uint8)
+>>> decimate(numpy.arange(16, dtype=numpy.uint8).reshape(4, 4), 2, 'stride')
+array([[ 0,  2],
+       [ 8, 10]], dtype=uint8)
+>>> l = frames.layout(1, 1)
+>>> p = Preview(l, factor=4, max_rate=None)
+>>> thumbnails = p.subscribe()
+>>> p.offer(frames.Frame(numpy.ones(l.shape, numpy.uint8), 0, 0.))
+True
+>>> t = thumbnails.get(timeout=5.)
+>>> (t.seq, t.image.shape)
+(0, (30, 40))
+>>> p.stop()
+"""
+import logging, Queue, threading, time
+
+import numpy
+
+import voodoo.component.frames as frames
+
+def decimate(image, factor, method='box'):
+    """
+    Downscale image (height x width [x channels]) by an integer factor:
+    'box' averages factor x factor blocks, 'stride' keeps one pixel
+    of each block.
+    """
+    if image.ndim < 2:
+        raise ValueError("packed images cannot be decimated")
+    if method == 'stride':
+        return image[::factor, ::factor].copy()
+    if method != 'box':
+        raise ValueError("unknown decimation method %s" % method)
+    (h, w) = (image.shape[0] // factor, image.shape[1] // factor)
+    n = factor * factor
+    if image.dtype == numpy.uint8 and n * 255 <= 65535:
+        accumulator = numpy.uint16
+    elif image.dtype.kind in 'ui':
+        accumulator = numpy.int64
+    else:
+        accumulator = numpy.float64
+    total = numpy.zeros((h, w) + image.shape[2:], accumulator)
+    # Adding the factor x factor strided views is much faster than
+    # reducing a reshaped array over two axes.
+    for i in range(factor):
+        for j in range(factor):
+            total += image[i:h * factor:factor, j:w * factor:factor]
+    if image.dtype.kind in 'ui':
+        total += n // 2
+        total //= n
+    else:
+        total /= n
+    return total.astype(image.dtype)
+
+
+class Preview:
+    """Produce thumbnails of the frames offered, in a worker thread."""
+
+    def __init__(self, layout, factor=4, max_rate=5., method='box'):
+        if len(layout.shape) < 2:
+            raise ValueError("packed images cannot be previewed")
+        self.logger = logging.getLogger('voodoo.component.preview')
+        self.factor = factor
+        self.period = max_rate and 1. / max_rate or 0.
+        self.method = method
+        self.staging = numpy.empty(layout.shape, layout.dtype)
+        self.staged = None
+        self.due = 0.
+        self.subscribers = []
+        self.condition = threading.Condition()
+        self.running = True
+        self.offered = 0
+        self.produced = 0
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def offer(self, frame):
+        """
+        Offer a frame of the stream. Return whether it was taken for
+        a thumbnail.
+        """
+        self.offered += 1
+        now = time.time()
+        if now < self.due or self.staged is not None:
+            return False
+        self.due = now + self.period
+        try:
+            frames.copy_frame(frame, self.staging)
+        except frames.TornFrame:
+            return False
+        self.condition.acquire()
+        try:
+            self.staged = (frame.seq, frame.timestamp)
+            self.condition.notify()
+        finally:
+            self.condition.release()
+        return True
+
+    def subscribe(self, callback=None, maxsize=2):
+        """
+        Subscribe to thumbnails (frames). callback is called with each
+        thumbnail; without callback, a Queue keeping the maxsize
+        latest thumbnails is returned.
+        """
+        if callback is None:
+            q = Queue.Queue(maxsize)
+            def callback(thumbnail):
+                try:
+                    q.put_nowait(thumbnail)
+                except Queue.Full:
+                    try:
+                        q.get_nowait()
+                    except Queue.Empty:
+                        pass
+                    q.put_nowait(thumbnail)
+        else:
+            q = None
+        self.subscribers.append(callback)
+        return q
+
+    def _run(self):
+        while True:
+            self.condition.acquire()
+            try:
+                while self.running and self.staged is None:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                (seq, timestamp) = self.staged
+            finally:
+                self.condition.release()
+            thumbnail = frames.Frame(
+                decimate(self.staging, self.factor, self.method),
+                seq, timestamp)
+            # Release the staging buffer before publishing.
+            self.staged = None
+            self.produced += 1
+            for callback in list(self.subscribers):
+                try:
+                    callback(thumbnail)
+                except Exception, e:
+                    self.logger.warning("preview subscriber failed: %s" % e)
+
+    def stats(self):
+        return {'offered': self.offered, 'produced': self.produced}
+
+    def stop(self):
+        self.condition.acquire()
+        try:
+            self.running = False
+            self.condition.notify()
+        finally:
+            self.condition.release()
+        self.thread.join()
+
+__all__ = ["Preview", "decimate"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -0,0 +1,248 @@
+"""
+Memory-mapped frame recordings.
+
+A recording is a single preallocated file made of a header, a frame
+index (sequence number, timestamp and offset of each frame) and the
+frame data. Frames are written in place through a memory map and read
+back as zero-copy numpy views, either directly or replayed at
+real-time, accelerated or unthrottled rate.
+
+>>> import numpy, os, tempfile, voodoo.component.frames as frames
+>>> path = tempfile.mktemp()
+>>> l = frames.layout(1, 1)
+>>> r = Recorder(path, l, 10)
+>>> for i in range(3):
+...     r.record(frames.Frame(numpy.zeros(l.shape, numpy.uint8) + i, i, i))
+>>> r.close()
+>>> rec = Recording(path)
+>>> (len(rec), rec.layout.shape, int(rec[2].image[0, 0]))
+(3, (120, 160), 2)
+>>> [f.seq for f in rec.replay(rate=None)]
+[0, 1, 2]
+>>> os.remove(path)
+"""
+import os, re, sys, time
+
+import numpy
+
+import voodoo.component.frames as frames
+from voodoo.component.frames import TornFrame
+
+MAGIC = 'VDREC001'
+VERSION = 1
+
+HEADER = numpy.dtype([('magic', 'S8'), ('version', '<u4'),
+                      ('width', '<u4'), ('height', '<u4'),
+                      ('format', '<u4'), ('capacity', '<u8'),
+                      ('count', '<u8'), ('index_offset', '<u8'),
+                      ('data_offset', '<u8'), ('frame_size', '<u8'),
+                      ('reserved', '<u8')])
+
+INDEX = numpy.dtype([('seq', '<u8'), ('timestamp', '<f8'), ('offset', '<u8')])
+
+# Frame data is aligned on pages.
+ALIGNMENT = 4096
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class Recorder:
+    """Record frames of a given layout into a preallocated file."""
+
+    def __init__(self, path, layout, capacity):
+        self.layout = layout
+        self.capacity = capacity
+        index_offset = HEADER.itemsize
+        data_offset = _align(index_offset + INDEX.itemsize * capacity)
+        frame_size = _align(layout.nbytes)
+        size = data_offset + frame_size * capacity
+
+        f = open(path, 'w+b')
+        try:
+            f.truncate(size)
+        finally:
+            f.close()
+        self.map = numpy.memmap(path, numpy.uint8, 'r+', 0, (size,))
+        self.header = self.map[:HEADER.itemsize].view(HEADER)
+        self.header['magic'] = MAGIC
+        self.header['version'] = VERSION
+        self.header['width'] = layout.width
+        self.header['height'] = layout.height
+        self.header['format'] = layout.format
+        self.header['capacity'] = capacity
+        self.header['count'] = 0
+        self.header['index_offset'] = index_offset
+        self.header['data_offset'] = data_offset
+        self.header['frame_size'] = frame_size
+        self.index = self.map[index_offset:
+                              index_offset + INDEX.itemsize * capacity] \
+                              .view(INDEX)
+        self.data = self.map[data_offset:].reshape(capacity, frame_size)
+        self.count = 0
+        self.torn = 0
+
+    def record(self, frame):
+        """
+        Append a frame. Raise an exception if the file is full, and
+        TornFrame, recording nothing, if the frame was overwritten in
+        its poster while copied.
+        """
+        if self.count >= self.capacity:
+            raise Exception("recording is full (%d frames)" % self.capacity)
+        slot = self.data[self.count, :self.layout.nbytes] \
+            .view(self.layout.dtype).reshape(self.layout.shape)
+        frames.copy_frame(frame, slot)
+        entry = self.index[self.count]
+        entry['seq'] = frame.seq
+        entry['timestamp'] = frame.timestamp
+        entry['offset'] = self.header['data_offset'][0] \
+            + self.count * self.header['frame_size'][0]
+        self.count += 1
+        self.header['count'] = self.count
+
+    def record_all(self, frames, count=None):
+        """
+        Record the frames of an iterator (see Viam.iter_frames). Torn
+        frames are skipped and counted in self.torn.
+        """
+        for frame in frames:
+            if count is not None and self.count >= count:
+                break
+            try:
+                self.record(frame)
+            except TornFrame:
+                self.torn += 1
+
+    def close(self):
+        self.map.flush()
+        del self.data, self.index, self.header, self.map
+
+
+class Recording:
+    """Read-only, memory-mapped access to a recording."""
+
+    def __init__(self, path):
+        self.map = numpy.memmap(path, numpy.uint8, 'r')
+        header = self.map[:HEADER.itemsize].view(HEADER)[0]
+        if header['magic'] != MAGIC:
+            raise ValueError("%s is not a frame recording" % path)
+        if header['version'] != VERSION:
+            raise ValueError("unsupported recording version %d"
+                             % header['version'])
+        self.layout = frames.Layout(int(header['width']),
+                                    int(header['height']),
+                                    int(header['format']))
+        self.count = int(header['count'])
+        offset = int(header['index_offset'])
+        self.index = self.map[offset:offset + INDEX.itemsize * self.count] \
+            .view(INDEX)
+        self.timestamps = self.index['timestamp']
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        entry = self.index[i]
+        offset = int(entry['offset'])
+        image = self.map[offset:offset + self.layout.nbytes] \
+            .view(self.layout.dtype).reshape(self.layout.shape)
+        return frames.Frame(image, int(entry['seq']),
+                            float(entry['timestamp']))
+
+    def __iter__(self):
+        for i in xrange(self.count):
+            yield self[i]
+
+    def replay(self, rate=1., start=0, stop=None):
+        """
+        Yield the frames following their timestamps: at real-time
+        for rate 1, accelerated for larger rates, as fast as possible
+        if rate is None. Frames are due at absolute deadlines, so that
+        the time spent by the consumer does not accumulate as drift.
+        """
+        stop = self.count if stop is None else min(stop, self.count)
+        if start >= stop:
+            return
+        origin = self.timestamps[start]
+        begin = time.time()
+        for i in xrange(start, stop):
+            if rate:
+                delay = begin + (self.timestamps[i] - origin) / rate \
+                    - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            yield self[i]
+
+
+def read_pnm(path):
+    """
+    Read a binary PGM (P5) or PPM (P6) image.
+    Return its pixels and the matching HwFmt value.
+    """
+    f = open(path, 'rb')
+    try:
+        content = f.read()
+    finally:
+        f.close()
+    tokens = []
+    pos = 0
+    token = re.compile(r'\s*(?:#[^\n]*\n\s*)*(\S+)')
+    while len(tokens) < 4:
+        m = token.match(content, pos)
+        if not m:
+            raise ValueError("%s: truncated header" % path)
+        tokens.append(m.group(1))
+        pos = m.end()
+    (magic, width, height, maxval) = \
+        (tokens[0], int(tokens[1]), int(tokens[2]), int(tokens[3]))
+    pos += 1
+    if magic == 'P5':
+        channels = 1
+        (format, dtype) = maxval < 256 and (1, numpy.uint8) or (2, '>u2')
+    elif magic == 'P6' and maxval < 256:
+        (channels, format, dtype) = (3, 6, numpy.uint8)
+    else:
+        raise ValueError("%s: unsupported image type %s" % (path, magic))
+    pixels = numpy.frombuffer(content, dtype, width * height * channels, pos)
+    shape = channels == 1 and (height, width) or (height, width, channels)
+    return (pixels.reshape(shape), format)
+
+def convert_ppm(pattern, path, fps=30., first=0):
+    """
+    Convert a sequence of images (e.g. 'image%04d.ppm', numbered from
+    first until a file is missing) into a recording at path.
+    Timestamps are spaced by 1 / fps. Return the number of frames.
+    """
+    files = []
+    while os.path.exists(pattern % (first + len(files))):
+        files.append(pattern % (first + len(files)))
+    if not files:
+        raise ValueError("no image matches %s" % pattern)
+    (image, format) = read_pnm(files[0])
+    layout = frames.Layout(image.shape[1], image.shape[0], format)
+    recorder = Recorder(path, layout, len(files))
+    try:
+        for (i, name) in enumerate(files):
+            if i:
+                (image, format) = read_pnm(name)
+            recorder.record(frames.Frame(image, i, i / float(fps)))
+    finally:
+        recorder.close()
+    return len(files)
+
+__all__ = ["Recorder", "Recording", "convert_ppm", "read_pnm"]
+
+if __name__ == "__main__":
+    if len(sys.argv) in (3, 4):
+        # python recording.py image%04d.ppm output.rec [fps]
+        fps = len(sys.argv) == 4 and float(sys.argv[3]) or 30.
+        print "%d frame(s) converted" % convert_ppm(sys.argv[1], sys.argv[2],
+                                                    fps)
+    else:
+        import doctest
+        doctest.testmod(verbose=True)
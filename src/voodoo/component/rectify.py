@@ -0,0 +1,203 @@
+"""
+Precomputed rectification maps.
+
+A camera model (intrinsics, distortion and optional rectification) is
+turned once into remap lookup tables for a given output size. The
+tables are saved as .npy files keyed by a hash of the camera model and
+of the size, and are memory-mapped when used again, so neither startup
+nor a resolution change recomputes them. Frames are then rectified by
+a vectorized numpy gather.
+
+The camera model is given as arguments: the calibration files loaded
+by Viam (see Viam.calibration_io) are not parsed here.
+
+>>> import numpy, shutil, tempfile
+>>> d = tempfile.mkdtemp()
+>>> c = Calibration(8, 6, [[4, 0, 3.5], [0, 4, 2.5], [0, 0, 1]],
+...                 [0, 0, 0, 0])
+>>> m = rectification_map(c, 1., 1., d)
+>>> m.shape
+(6, 8)
+>>> image = numpy.arange(48, dtype=numpy.uint8).reshape(6, 8)
+>>> bool((m.remap(image) == image).all())
+True
+>>> len([n for n in os.listdir(d) if n.endswith(".npy")])
+4
+>>> shutil.rmtree(d)
+"""
+import hashlib, os
+
+import numpy
+
+class Calibration:
+    """
+    Camera model of images of width x height pixels: K is the camera
+    matrix (3x3), D the Brown-Conrady distortion (k1, k2, p1, p2
+    [, k3]), R the rectification rotation (3x3, identity by default)
+    and P the rectified camera matrix (3x3 or 3x4, K by default).
+    """
+
+    def __init__(self, width, height, K, D=None, R=None, P=None):
+        self.width = int(width)
+        self.height = int(height)
+        self.K = numpy.array(K, numpy.float64).reshape(3, 3)
+        self.D = numpy.zeros(5)
+        d = numpy.ravel(D if D is not None else [])[:5]
+        self.D[:len(d)] = d
+        self.R = numpy.array(R if R is not None else numpy.eye(3),
+                             numpy.float64).reshape(3, 3)
+        if P is not None:
+            P = numpy.array(P, numpy.float64).ravel()
+            self.P = P.reshape(3, len(P) // 3)[:, :3]
+        else:
+            self.P = self.K.copy()
+
+    def digest(self):
+        """Return a hash of the camera model."""
+        h = hashlib.sha1("%dx%d" % (self.width, self.height))
+        for a in (self.K, self.D, self.R, self.P):
+            h.update(numpy.ascontiguousarray(a).tostring())
+        return h.hexdigest()
+
+
+class RectificationMap:
+    """
+    Lookup tables mapping each rectified pixel to the source image:
+    flat index of the top-left source pixel, interpolation weights
+    and validity.
+    """
+
+    def __init__(self, index, fx, fy, valid, source_shape):
+        self.index = index
+        self.fx = fx
+        self.fy = fy
+        self.valid = valid
+        self.shape = index.shape
+        self.source_shape = source_shape
+
+    def remap(self, image, bilinear=True, out=None):
+        """Return the rectified image (of shape self.shape)."""
+        (h, w) = self.source_shape
+        if image.shape[:2] != (h, w):
+            raise ValueError("image is %dx%d, map expects %dx%d"
+                             % (image.shape[1], image.shape[0], w, h))
+        flat = image.reshape((h * w,) + image.shape[2:])
+        if not bilinear:
+            fx = (self.fx >= 0.5).astype(numpy.intp)
+            fy = (self.fy >= 0.5).astype(numpy.intp)
+            res = flat[self.index + fx + fy * w]
+        else:
+            fx = self.fx
+            fy = self.fy
+            if image.ndim == 3:
+                fx = fx[..., numpy.newaxis]
+                fy = fy[..., numpy.newaxis]
+            top = flat[self.index] * (1 - fx) + flat[self.index + 1] * fx
+            bottom = flat[self.index + w] * (1 - fx) \
+                + flat[self.index + w + 1] * fx
+            res = top * (1 - fy) + bottom * fy
+            if image.dtype.kind in 'ui':
+                res = numpy.rint(res)
+        if out is None:
+            out = numpy.empty(self.shape + image.shape[2:], image.dtype)
+        out[...] = res
+        out[~self.valid] = 0
+        return out
+
+
+def output_size(calibration, to_width, to_height):
+    """
+    Return the output size in pixels. As for push_geo_filter, sizes
+    up to 1 are ratios of the calibrated size.
+
+    >>> class C: width, height = 640, 480
+    >>> output_size(C, 1., 1)
+    (640, 480)
+    >>> output_size(C, 320, 240)
+    (320, 240)
+    """
+    if to_width <= 1:
+        to_width = calibration.width * to_width
+    if to_height <= 1:
+        to_height = calibration.height * to_height
+    return (int(round(to_width)), int(round(to_height)))
+
+def compute_map(calibration, width, height):
+    """Compute the rectification map of a calibration for an output size."""
+    c = calibration
+    (sx, sy) = (float(width) / c.width, float(height) / c.height)
+    # Rectified camera matrix scaled to the output size.
+    P = c.P * [[sx], [sy], [1.]]
+    (u, v) = numpy.meshgrid(numpy.arange(width, dtype=numpy.float64),
+                            numpy.arange(height, dtype=numpy.float64))
+    rays = numpy.dot(numpy.linalg.inv(numpy.dot(P, c.R)),
+                     numpy.array([u.ravel(), v.ravel(), numpy.ones(u.size)]))
+    x = rays[0] / rays[2]
+    y = rays[1] / rays[2]
+    (k1, k2, p1, p2, k3) = c.D
+    r2 = x * x + y * y
+    radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    xd = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+    yd = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+    mx = (c.K[0, 0] * xd + c.K[0, 1] * yd + c.K[0, 2]).reshape(height, width)
+    my = (c.K[1, 1] * yd + c.K[1, 2]).reshape(height, width)
+
+    (h, w) = (c.height, c.width)
+    valid = (mx >= 0) & (mx <= w - 1) & (my >= 0) & (my <= h - 1)
+    x0 = numpy.clip(numpy.floor(mx), 0, w - 2)
+    y0 = numpy.clip(numpy.floor(my), 0, h - 2)
+    fx = numpy.clip(mx - x0, 0., 1.).astype(numpy.float32)
+    fy = numpy.clip(my - y0, 0., 1.).astype(numpy.float32)
+    index = (y0 * w + x0).astype(numpy.int32)
+    return RectificationMap(index, fx, fy, valid, (h, w))
+
+
+_maps = {}
+
+def default_cache_dir():
+    return os.path.join(os.getenv("HOME", "/tmp"), ".cache", "voodoo",
+                        "rectify")
+
+def rectification_map(calibration, to_width=1., to_height=1.,
+                      cache_dir=None):
+    """
+    Return the rectification map of a Calibration for an output size
+    (see output_size), computing it only if it is neither in memory
+    nor in the on-disk cache.
+    """
+    (width, height) = output_size(calibration, to_width, to_height)
+    key = "%s-%dx%d" % (calibration.digest(), width, height)
+    if key in _maps:
+        return _maps[key]
+
+    cache_dir = cache_dir or default_cache_dir()
+    names = dict((n, os.path.join(cache_dir, "%s-%s.npy" % (key, n)))
+                 for n in ('index', 'fx', 'fy', 'valid'))
+    if all(os.path.exists(p) for p in names.values()):
+        arrays = dict((n, numpy.load(p, mmap_mode='r'))
+                      for (n, p) in names.items())
+        m = RectificationMap(arrays['index'], arrays['fx'], arrays['fy'],
+                             arrays['valid'],
+                             (calibration.height, calibration.width))
+    else:
+        m = compute_map(calibration, width, height)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        for (n, p) in names.items():
+            # Write then rename, so that readers never see partial files.
+            tmp = "%s.%d.tmp" % (p, os.getpid())
+            f = open(tmp, 'wb')
+            try:
+                numpy.save(f, getattr(m, n))
+            finally:
+                f.close()
+            os.rename(tmp, p)
+    _maps[key] = m
+    return m
+
+__all__ = ["Calibration", "RectificationMap", "compute_map",
+           "output_size", "rectification_map"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
@@ -0,0 +1,120 @@
+"""
+Timestamp synchronization of the frames of several cameras.
+
+Frames of each camera arrive in timestamp order. Whenever every camera
+has a pending frame, the pending heads are compared: if they all lie
+within the tolerance, they are emitted together (e.g. a stereo pair);
+otherwise the oldest head cannot match anything anymore and is dropped
+as unmatched. Pending frames are bounded per camera.
+
+Pending frames are kept by reference: they must stay valid until they
+are matched (copy zero-copy poster views beforehand).
+
+>>> from voodoo.component.frames import Frame
+>>> s = FrameSynchronizer(['left', 'right'], tolerance=0.005)
+>>> s.push('left', Frame(None, 0, 0.000))
+[]
+>>> s.push('left', Frame(None, 1, 0.033))
+[]
+>>> [tuple(f.seq for f in m) for m in s.push('right', Frame(None, 0, 0.032))]
+[(1, 0)]
+>>> st = s.stats()
+>>> (st['matched'], sorted(st['unmatched'].items()))
+(1, [('left', 1), ('right', 0)])
+"""
+import collections, heapq
+
+class FrameSynchronizer:
+    """Match the frames of several cameras by timestamp."""
+
+    def __init__(self, cameras, tolerance, max_pending=8):
+        self.cameras = list(cameras)
+        self.position = dict((c, i) for (i, c) in enumerate(self.cameras))
+        self.tolerance = tolerance
+        self.pending = [collections.deque() for c in self.cameras]
+        self.max_pending = max_pending
+        self.matched = 0
+        self.unmatched = [0] * len(self.cameras)
+        self.skew_sum = 0.
+        self.skew_max = 0.
+
+    def push(self, camera, frame):
+        """
+        Add a frame of camera and return the list of the tuples of
+        frames (in camera order) matched as a consequence.
+        """
+        i = self.position[camera]
+        queue = self.pending[i]
+        if len(queue) >= self.max_pending:
+            queue.popleft()
+            self.unmatched[i] += 1
+        queue.append(frame)
+        return self._match()
+
+    def _match(self):
+        res = []
+        while all(self.pending):
+            heads = [q[0].timestamp for q in self.pending]
+            oldest = min(heads)
+            skew = max(heads) - oldest
+            if skew <= self.tolerance:
+                res.append(tuple(q.popleft() for q in self.pending))
+                self.matched += 1
+                self.skew_sum += skew
+                self.skew_max = max(self.skew_max, skew)
+            else:
+                i = heads.index(oldest)
+                self.pending[i].popleft()
+                self.unmatched[i] += 1
+        return res
+
+    def flush(self):
+        """Drop every pending frame as unmatched."""
+        for (i, q) in enumerate(self.pending):
+            self.unmatched[i] += len(q)
+            q.clear()
+
+    def stats(self):
+        """Return the matched count, unmatched counts and pairing skew."""
+        return {'matched': self.matched,
+                'unmatched': dict(zip(self.cameras, self.unmatched)),
+                'pending': dict(zip(self.cameras,
+                                    [len(q) for q in self.pending])),
+                'skew_mean': self.matched and
+                    self.skew_sum / self.matched or 0.,
+                'skew_max': self.skew_max}
+
+    def merge(self, streams):
+        """
+        Merge frame iterators, given as a dict camera -> iterator, by
+        timestamp (heap merge) and yield the matched tuples.
+
+        >>> from voodoo.component.frames import Frame
+        >>> s = FrameSynchronizer(['l', 'r'], 0.01)
+        >>> l = [Frame(None, i, i * 0.1) for i in range(3)]
+        >>> r = [Frame(None, i, i * 0.1 + 0.002) for i in range(3)]
+        >>> len(list(s.merge({'l': iter(l), 'r': iter(r)})))
+        3
+        """
+        heap = []
+        for (camera, it) in streams.items():
+            for frame in it:
+                heap.append((frame.timestamp, self.position[camera],
+                             frame, it))
+                break
+        heapq.heapify(heap)
+        while heap:
+            (t, i, frame, it) = heap[0]
+            for match in self.push(self.cameras[i], frame):
+                yield match
+            for frame in it:
+                heapq.heapreplace(heap, (frame.timestamp, i, frame, it))
+                break
+            else:
+                heapq.heappop(heap)
+
+__all__ = ["FrameSynchronizer"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
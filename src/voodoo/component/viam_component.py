@@ -1,8 +1,18 @@
-import logging, os, time, unittest
+import copy, logging, os, threading, unittest
 
+import numpy
 import viam as _viam
 
 import voodoo.util
+import voodoo.util.dispatcher as dispatcher
+import voodoo.util.lru as lru
+import voodoo.component.acquisition as acquisition
+import voodoo.component.frames as frames
+import voodoo.component.preview as preview
+import voodoo.component.recording as recording
+import voodoo.component.rectify as rectify
+import voodoo.component.sync as sync
+import voodoo.component.viam_pipeline as pipeline
 
 ImageUpdate = voodoo.util.enum (('', 'SINGLE_BUFFERING', 'DOUBLE_BUFFERING'))
 Active = voodoo.util.enum (('DISABLE', 'ENABLE'))
@@ -77,11 +87,36 @@ FilterAutomode = voodoo.util.enum ((
         '', '', '', '', '', '', '',
         'SOFTWARE_ONE_PUSH'))
 
-def make_viam_id(str):
+PIPELINE_ENUMS = {
+    'buffering': ImageUpdate,
+    'active': Active,
+    'size': HwSize,
+    'format': HwFmt,
+    'crop': HwCrop,
+    'fps': HwFps,
+    'trigger': HwTrigger,
+    'type': Filter,
+    'method': FilterMethod,
+    'automode': FilterAutomode,
+    'enable': OnOff,
+    'vtag': OnOff
+    }
+
+# Builders run in control loops: identifiers are interned and the
+# requests sent repeatedly are reusable templates (see
+# voodoo.util.lru), one set per thread. Returned objects are reused
+# and must not be modified by callers.
+_ids = lru.LRUCache(1024)
+_templates = lru.RequestTemplates(256)
+
+def _new_viam_id(str):
     res = _viam.ViamId()
     res.id = str
     return res
 
+def make_viam_id(str):
+    return _ids.get_or_create(str, _new_viam_id, str)
+
 def make_viam_camera_create(name, uid):
     res = _viam.ViamCameraCreate()
     res.name = make_viam_id(name)
@@ -136,36 +171,58 @@ def make_viam_geo_filter(filter, image, type, method, automode,
     (res.toWidth, res.toHeight) = (toWidth, toHeight)
     return res
 
-def make_viam_acquire(bank, n):
+def _new_viam_acquire(bank):
     res = _viam.ViamAcquire()
     res.bank = make_viam_id(bank)
-    res.n = n
     return res
 
-def make_viam_display(bank, image, enable, vtag, width, height):
+def _fill_viam_acquire(res, n):
+    res.n = n
+
+def make_viam_acquire(bank, n):
+    return _templates.request('acquire', (bank,), _new_viam_acquire,
+                              (n,), _fill_viam_acquire)
+
+def _new_viam_display(bank, image):
     res = _viam.ViamDisplay()
     res.bank = make_viam_id(bank)
     res.image = make_viam_id(image)
+    return res
+
+def _fill_viam_display(res, enable, vtag, width, height):
     res.enable = enable
     res.vtag = vtag
     res.width = width
     res.height = height
-    return res
+
+def make_viam_display(bank, image, enable, vtag, width, height):
+    return _templates.request('display', (bank, image), _new_viam_display,
+                              (enable, vtag, width, height),
+                              _fill_viam_display)
 
 
 class Viam:
+    ready_timeout = 30.
+
     def __init__(self, genom):
         self.genom = genom
         self.logger = logging.getLogger('voodoo.component.viam')
+        self.dispatcher = None
+        # Guards the creation of the dispatcher by concurrent submits.
+        self.dispatcher_lock = threading.Lock()
+        self.applied = None
+        # Requests sent by an apply that failed, since self.applied.
+        self.applied_calls = []
+        self.hw_modes = {}
+        self.bank_images = {}
+        self.acquisitions = {}
+        self.synchronizers = {}
+        self.previews = {}
 
     def __enter__(self):
-        import voodoo.middleware.genom as genom
-
         self.start()
 
-        # Wait for the component to start.
-        while not genom.module_ready('viam'):
-            time.sleep(0.1)
+        self.genom.wait_ready('viam', self.ready_timeout)
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
@@ -175,7 +232,31 @@ class Viam:
     def start(self):
         self.genom.startComponent('viam')
 
+    def submit(self, method, *args, **kwargs):
+        """
+        Call method (a method name) asynchronously and return a
+        voodoo.util.dispatcher.Future. Requests to this component run
+        in submission order, concurrently with requests to other
+        components. The keyword argument deadline (seconds) fails the
+        request if it did not start in time.
+        """
+        with self.dispatcher_lock:
+            if self.dispatcher is None:
+                self.dispatcher = dispatcher.Dispatcher('viam')
+            d = self.dispatcher
+        return d.submit(getattr(self, method), *args, **kwargs)
+
+    def latency_stats(self):
+        """Return the latency summary of each kind of submitted request."""
+        return self.dispatcher and self.dispatcher.stats() or {}
+
     def stop(self):
+        with self.dispatcher_lock:
+            (d, self.dispatcher) = (self.dispatcher, None)
+        if d:
+            d.stop()
+        for bank in self.acquisitions.keys():
+            self.stop_acquisition(bank)
         self.genom.stopComponent('viam')
 
     def driver_load(self, driver):
@@ -196,6 +277,7 @@ class Viam:
         self.logger.info("add camera %s to bank %s using name %s" % (camera, bank, name))
         arg = make_viam_bank_add_camera(bank, camera, name)
         _viam.BankAddCamera(arg)
+        self.bank_images[(bank, name)] = camera
 
 
     def camera_set_hw_mode(self, camera, size, format, crop, fps, trigger):
@@ -204,6 +286,7 @@ class Viam:
         mode = make_viam_hwmode_t(size, format, crop, fps, trigger)
         arg = make_viam_hw_mode(camera, mode)
         _viam.CameraSetHWMode(arg)
+        self.hw_modes[camera] = (size, format)
 
     def calibration_io(self, bank, op, file):
         self.logger.info("set calibration I/O for bank %s (action = %s, file = %s)"
@@ -237,6 +320,188 @@ class Viam:
         arg = make_viam_display(bank, image, enable, vtag, width, height)
         _viam.Display(arg)
 
+    def frame_layout(self, bank, image):
+        """Return the layout of the frames of an image of a bank."""
+        camera = self.bank_images.get((bank, image))
+        if camera not in self.hw_modes:
+            raise Exception("no hardware mode known for image %s of bank %s"
+                            % (image, bank))
+        return frames.layout(*self.hw_modes[camera])
+
+    def iter_frames(self, bank, image, poster, count=None):
+        """
+        Acquire frames on bank and yield the frames of image as numpy
+        views on its poster (a path or a buffer), without copying them.
+        See voodoo.component.frames.
+        """
+        if isinstance(poster, basestring):
+            poster = frames.open_poster(poster)
+        layout = self.frame_layout(bank, image)
+        # The request is a reused template: build it for each call.
+        return frames.iter_frames(
+            poster, layout,
+            lambda: _viam.Acquire(make_viam_acquire(bank, 1)), count)
+
+    def rectification_map(self, calibration, toWidth=1., toHeight=1.):
+        """
+        Return the precomputed rectification map of a camera model (a
+        voodoo.component.rectify.Calibration, built from the intrinsics
+        and distortion of the camera), to rectify frames in Python
+        instead of through a software RECTIFY filter.
+        """
+        return rectify.rectification_map(calibration, toWidth, toHeight)
+
+    def record(self, bank, image, poster, path, count):
+        """
+        Acquire count frames of image on bank and record them into
+        a memory-mapped recording at path (see
+        voodoo.component.recording).
+        """
+        self.logger.info("record %d image(s) of bank %s in %s"
+                         % (count, bank, path))
+        recorder = recording.Recorder(path, self.frame_layout(bank, image),
+                                      count)
+        try:
+            recorder.record_all(self.iter_frames(bank, image, poster, count))
+        finally:
+            recorder.close()
+
+    def iter_synchronized(self, bank, posters, tolerance, max_pending=8,
+                          count=None):
+        """
+        Acquire frames on bank and yield the tuples of frames of its
+        images (posters is a list of (image, poster) pairs, e.g. the
+        left and right images of a stereo bank) whose timestamps lie
+        within tolerance. Frames are copied into preallocated slots and
+        stay valid until the next tuple is requested. The pairing
+        statistics are given by self.synchronizers[bank].stats().
+        """
+        images = [image for (image, poster) in posters]
+        sources = []
+        for (image, poster) in posters:
+            if isinstance(poster, basestring):
+                poster = frames.open_poster(poster)
+            layout = self.frame_layout(bank, image)
+            # Pending frames, the frame being read and the frames
+            # held by the consumer.
+            slots = [numpy.empty(layout.shape, layout.dtype)
+                     for i in range(max_pending + 2)]
+            sources.append((image, poster, layout, slots))
+        synchronizer = sync.FrameSynchronizer(images, tolerance, max_pending)
+        self.synchronizers[bank] = synchronizer
+        last = dict((image, None) for image in images)
+        written = dict((image, 0) for image in images)
+        n = 0
+        while count is None or n < count:
+            _viam.Acquire(make_viam_acquire(bank, 1))
+            for (image, poster, layout, slots) in sources:
+                frame = frames.read_frame(poster, layout)
+                if frame.seq == last[image]:
+                    continue
+                last[image] = frame.seq
+                slot = slots[written[image] % len(slots)]
+                try:
+                    copy = frames.copy_frame(frame, slot)
+                except frames.TornFrame:
+                    continue
+                written[image] += 1
+                for match in synchronizer.push(image, copy):
+                    n += 1
+                    yield match
+
+    def process(self, bank, image, poster, pool, count=None):
+        """
+        Acquire frames of image on bank and yield, in order, the
+        results of pool (a voodoo.component.frame_pool.FramePool) on
+        each frame. The pool forks its workers: create it before any
+        thread starts, e.g. before the components, and close it once
+        done.
+        """
+        layout = self.frame_layout(bank, image)
+        if (pool.layout.width, pool.layout.height, pool.layout.format) != \
+                (layout.width, layout.height, layout.format):
+            raise Exception("frame pool is set up for %dx%d images of "
+                            "format %d" % (pool.layout.width,
+                                           pool.layout.height,
+                                           pool.layout.format))
+        for res in pool.imap(self.iter_frames(bank, image, poster, count)):
+            yield res
+
+    def start_acquisition(self, bank, image, poster, maxsize=4,
+                          policy=acquisition.Policy.DROP_OLDEST):
+        """
+        Acquire frames of image continuously on bank. Frames go through
+        a bounded queue (see voodoo.component.acquisition) and are read
+        with the get method of the returned object.
+        """
+        self.stop_acquisition(bank)
+        self.logger.info("start continuous acquisition on bank %s" % bank)
+        res = acquisition.ContinuousAcquisition(
+            self.iter_frames(bank, image, poster),
+            self.frame_layout(bank, image), maxsize, policy)
+        self.acquisitions[bank] = res
+        return res
+
+    def stop_acquisition(self, bank):
+        self.stop_preview(bank)
+        res = self.acquisitions.pop(bank, None)
+        if res:
+            self.logger.info("stop continuous acquisition on bank %s" % bank)
+            res.stop()
+
+    def start_preview(self, bank, factor=4, max_rate=5., method='box'):
+        """
+        Produce thumbnails of the frames continuously acquired on bank,
+        downscaled by factor, at most max_rate per second. This is a
+        cheap alternative to display: thumbnails are computed in a
+        separate thread and read through the subscribe method of the
+        returned object (see voodoo.component.preview).
+        """
+        if bank not in self.acquisitions:
+            raise Exception("no continuous acquisition on bank %s" % bank)
+        self.stop_preview(bank)
+        self.logger.info("start preview of bank %s" % bank)
+        acquired = self.acquisitions[bank]
+        res = preview.Preview(acquired.layout, factor, max_rate, method)
+        acquired.previews.append(res)
+        self.previews[bank] = res
+        return res
+
+    def stop_preview(self, bank):
+        res = self.previews.pop(bank, None)
+        if res:
+            self.logger.info("stop preview of bank %s" % bank)
+            self.acquisitions[bank].previews.remove(res)
+            res.stop()
+
+    def acquisition_stats(self):
+        """Return the frame counters of each continuously acquired bank."""
+        return dict((bank, a.stats())
+                    for (bank, a) in self.acquisitions.items())
+
+    def apply(self, spec):
+        """
+        Apply a declarative pipeline spec (a dict or the path of a JSON
+        file, see voodoo.component.viam_pipeline). Only the requests
+        needed since the last applied spec are sent: after a failure,
+        the requests that already succeeded are not sent again, except
+        configure and display which follow the current state.
+        """
+        if isinstance(spec, basestring):
+            spec = pipeline.load(spec)
+        spec = pipeline.resolve(spec, PIPELINE_ENUMS)
+        calls = pipeline.plan(self.applied, spec, IO.LOAD)
+        done = list(self.applied_calls)
+        self.logger.info("applying pipeline (%d request(s))" % len(calls))
+        for (name, args) in calls:
+            if (name, args) in done and name not in ('configure', 'display'):
+                done.remove((name, args))
+                continue
+            getattr(self, name)(*args)
+            self.applied_calls.append((name, args))
+        self.applied = copy.deepcopy(spec)
+        self.applied_calls = []
+
 
 
 class basicTest(unittest.TestCase):
@@ -0,0 +1,212 @@
+"""
+Declarative configuration of a Viam pipeline.
+
+A pipeline spec is a dict (or a JSON file) describing drivers,
+cameras and banks. plan() compares it with the last applied spec and
+returns only the Viam requests needed to go from one to the other.
+
+>>> spec = {
+...     "drivers": ["file"],
+...     "cameras": {"c": {"uid": "file:/tmp/image%04d.ppm",
+...                       "hw_mode": {"size": 4, "format": 1, "crop": 0,
+...                                   "fps": 5, "trigger": 1}}},
+...     "banks": {"b": {"buffering": 2, "active": 1,
+...                     "cameras": {"c": "i"},
+...                     "calibration": "/tmp/bottom-left.data",
+...                     "filters": [{"name": "rectification", "image": "i",
+...                                  "type": 5, "method": 4, "automode": 1,
+...                                  "left": 0., "top": 0.,
+...                                  "right": 1., "bottom": 1.,
+...                                  "toWidth": 1., "toHeight": 1}],
+...                     "display": {"image": "i", "enable": 1, "vtag": 1,
+...                                 "width": 0, "height": 0}}}}
+>>> LOAD = 0        # IO.LOAD of voodoo.component.viam_component
+>>> [name for (name, args) in plan(None, spec, LOAD)]
+... #doctest: +NORMALIZE_WHITESPACE
+['driver_load', 'camera_create', 'bank_create', 'bank_add_camera',
+ 'camera_set_hw_mode', 'calibration_io', 'push_geo_filter', 'init',
+ 'configure', 'display']
+>>> import copy
+>>> new = copy.deepcopy(spec)
+>>> new["cameras"]["c"]["hw_mode"]["size"] = 2
+>>> plan(spec, new, LOAD)
+[('camera_set_hw_mode', ('c', 2, 1, 0, 5, 1)), ('configure', ('b',))]
+>>> plan(spec, spec, LOAD)
+[]
+>>> del new["banks"]["b"]["filters"][0]
+>>> plan(spec, new, LOAD)
+Traceback (most recent call last):
+...
+PipelineError: filter rectification cannot be removed from bank b
+>>> new = copy.deepcopy(spec)
+>>> new["banks"]["b"]["filters"][0]["right"] = 0.5
+>>> plan(spec, new, LOAD)
+Traceback (most recent call last):
+...
+PipelineError: filter rectification of bank b cannot be changed
+"""
+import json
+
+HW_MODE_FIELDS = ('size', 'format', 'crop', 'fps', 'trigger')
+FILTER_FIELDS = ('image', 'type', 'method', 'automode',
+                 'left', 'top', 'right', 'bottom', 'toWidth', 'toHeight')
+DISPLAY_FIELDS = ('image', 'enable', 'vtag', 'width', 'height')
+
+class PipelineError(Exception):
+    """Raised when a spec change cannot be applied incrementally."""
+    pass
+
+def load(path):
+    """Load a pipeline spec from a JSON file."""
+    f = open(path)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+def resolve(spec, enums):
+    """
+    Replace enum names by their values. enums maps a field name
+    ('buffering', 'size', 'type'...) to the enum of its values.
+
+    >>> class HwSize:
+    ...     _640x480 = 4
+    >>> resolve({"cameras": {"c": {"hw_mode": {"size": "_640x480"}}}},
+    ...         {"size": HwSize})
+    {'cameras': {'c': {'hw_mode': {'size': 4}}}}
+    """
+    if isinstance(spec, dict):
+        res = {}
+        for (k, v) in spec.items():
+            if k in enums and isinstance(v, basestring):
+                v = getattr(enums[k], v)
+            else:
+                v = resolve(v, enums)
+            res[str(k)] = v
+        return res
+    if isinstance(spec, list):
+        return [resolve(item, enums) for item in spec]
+    if isinstance(spec, unicode):
+        return str(spec)
+    return spec
+
+def _changed(old, new, key):
+    return (old or {}).get(key) != (new or {}).get(key)
+
+def plan(old, new, load):
+    """
+    Return the list of (method, args) calls of Viam turning the
+    pipeline old (None if nothing was applied) into new. load is
+    the calibration_io operation loading a calibration (IO.LOAD).
+    Raise PipelineError for changes Viam cannot apply in place
+    (removing cameras, banks or filters, changing a camera uid or a
+    filter...).
+    """
+    old = old or {}
+    first = not old
+    calls = []
+    configure = set()
+
+    for driver in new.get('drivers', []):
+        if driver not in old.get('drivers', []):
+            calls.append(('driver_load', (driver,)))
+
+    old_cameras = old.get('cameras', {})
+    cameras = new.get('cameras', {})
+    for name in sorted(set(old_cameras) - set(cameras)):
+        raise PipelineError("camera %s cannot be removed" % name)
+    hw_modes = []
+    for name in sorted(cameras):
+        camera = cameras[name]
+        if name not in old_cameras:
+            calls.append(('camera_create', (name, camera['uid'])))
+        elif _changed(old_cameras[name], camera, 'uid'):
+            raise PipelineError("uid of camera %s cannot be changed" % name)
+        if 'hw_mode' in camera and \
+                _changed(old_cameras.get(name), camera, 'hw_mode'):
+            mode = camera['hw_mode']
+            hw_modes.append(('camera_set_hw_mode',
+                             (name,) + tuple(mode[f] for f in HW_MODE_FIELDS)))
+
+    old_banks = old.get('banks', {})
+    banks = new.get('banks', {})
+    for name in sorted(set(old_banks) - set(banks)):
+        raise PipelineError("bank %s cannot be removed" % name)
+    creates = []
+    adds = []
+    calibrations = []
+    filters = []
+    displays = []
+    for name in sorted(banks):
+        bank = banks[name]
+        old_bank = old_banks.get(name)
+        if old_bank is None:
+            creates.append(('bank_create',
+                            (name, bank['buffering'], bank['active'])))
+        elif _changed(old_bank, bank, 'buffering') or \
+                _changed(old_bank, bank, 'active'):
+            raise PipelineError("bank %s cannot be recreated" % name)
+        old_bank = old_bank or {}
+
+        old_members = old_bank.get('cameras', {})
+        members = bank.get('cameras', {})
+        for camera in sorted(members):
+            if camera not in cameras:
+                raise PipelineError("bank %s uses unknown camera %s"
+                                    % (name, camera))
+            if camera not in old_members:
+                adds.append(('bank_add_camera',
+                             (name, camera, members[camera])))
+                configure.add(name)
+            elif old_members[camera] != members[camera]:
+                raise PipelineError("camera %s of bank %s cannot be renamed"
+                                    % (camera, name))
+        for camera in old_members:
+            if camera not in members:
+                raise PipelineError("camera %s cannot be removed from bank %s"
+                                    % (camera, name))
+            if _changed(old_cameras.get(camera), cameras.get(camera),
+                        'hw_mode'):
+                configure.add(name)
+
+        if 'calibration' in bank and _changed(old_bank, bank, 'calibration'):
+            calibrations.append(('calibration_io',
+                                 (name, load, bank['calibration'])))
+            configure.add(name)
+
+        # Filters are identified by name. Viam may add a second filter
+        # rather than replace one pushed again under the same name, so
+        # filters can only be added.
+        old_filters = dict((f['name'], f) for f in old_bank.get('filters', []))
+        names = set(f['name'] for f in bank.get('filters', []))
+        for filter in sorted(set(old_filters) - names):
+            raise PipelineError("filter %s cannot be removed from bank %s"
+                                % (filter, name))
+        for f in bank.get('filters', []):
+            if f['name'] in old_filters and old_filters[f['name']] != f:
+                raise PipelineError("filter %s of bank %s cannot be changed"
+                                    % (f['name'], name))
+            if f['name'] not in old_filters:
+                filters.append(('push_geo_filter',
+                                (f['name'],)
+                                + tuple(f[k] for k in FILTER_FIELDS)))
+                configure.add(name)
+
+        if 'display' in bank and _changed(old_bank, bank, 'display'):
+            d = bank['display']
+            displays.append(('display',
+                             (name,) + tuple(d[k] for k in DISPLAY_FIELDS)))
+
+    calls += creates + adds + hw_modes + calibrations + filters
+    if first:
+        calls.append(('init', ()))
+        configure = set(banks)
+    calls += [('configure', (name,)) for name in sorted(configure)]
+    calls += displays
+    return calls
+
+__all__ = ["PipelineError", "load", "plan", "resolve"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
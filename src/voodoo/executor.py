@@ -0,0 +1,213 @@
+"""
+Real-time execution of movement plans.
+
+An executor sends the state of a plan to a target at a fixed control
+rate. Tick k is due at the absolute deadline start + k / rate, so the
+time spent by the target does not accumulate as drift; a last tick
+sends the end of the plan when it falls between two periods. States are
+computed at each tick from the plan (a lookup and an interpolation),
+so a plan opened from a file (see voodoo.plan_file) streams lazily.
+
+When the executor falls behind by a whole period or more, the missed
+ticks are dropped. With the SKIP policy the next tick sends the state
+of its own scheduled time; with INTERPOLATE the late tick sends the
+state interpolated at the time it actually runs.
+
+The wake-up jitter (actual start of a tick minus its deadline) and the
+latency (end of the call to the target minus the deadline) of every
+tick are recorded in histograms. Deadlines follow the monotonic
+clock, so setting the system time does not stall or skip ticks.
+
+>>> from voodoo.plan import MovementPlan
+>>> plan = MovementPlan([(0., [0.]), (0.1, [1.])])
+>>> sent = []
+>>> e = PlanExecutor(plan, lambda t, state: sent.append(state[0]), 100.)
+>>> e.run()
+>>> (len(sent) + e.missed, sent[0], sent[-1])
+(11, 0.0, 1.0)
+>>> plan = MovementPlan([(0., [0.]), (0.105, [1.])])
+>>> sent = []
+>>> e = PlanExecutor(plan, lambda t, state: sent.append((t, state[0])), 100.)
+>>> e.run()
+>>> (len(sent) + e.missed, sent[-1])
+(12, (0.105, 1.0))
+
+Stopping right after starting does not wait for the plan to end:
+
+>>> e = PlanExecutor(MovementPlan([(0., [0.]), (60., [1.])]),
+...                  lambda t, state: None, 100.)
+>>> e.start(); e.stop()
+>>> (e.running, e.ticks <= 1)
+(False, True)
+"""
+import ctypes, ctypes.util, logging, math, os, threading, time, unittest
+
+import voodoo.util
+from voodoo.util.histogram import Histogram
+
+Policy = voodoo.util.enum(('SKIP', 'INTERPOLATE'))
+
+CLOCK_MONOTONIC = 1
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno = True)
+
+def monotonic():
+    """Return the time of the monotonic clock, in seconds."""
+    t = _Timespec()
+    if _libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) < 0:
+        e = ctypes.get_errno()
+        raise OSError(e, os.strerror(e))
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+class PlanExecutor:
+    """
+    Send the states of plan to target(time, state) rate times per
+    second, time being the plan time of the state.
+    """
+
+    def __init__(self, plan, target, rate = 200., policy = Policy.SKIP,
+                 spin = 0.0002):
+        self.logger = logging.getLogger('voodoo.executor')
+        self.plan = plan
+        self.target = target
+        self.rate = rate
+        self.period = 1. / rate
+        self.policy = policy
+        # The end of each wait is spent polling the clock, since
+        # sleeping wakes up late by up to a scheduler tick.
+        self.spin = spin
+        self.jitter = Histogram()
+        self.latency = Histogram()
+        self.ticks = 0
+        self.missed = 0
+        self.running = False
+        self.stopping = threading.Event()
+        self.thread = None
+        self.error = None
+
+    def _wait(self, deadline):
+        delay = deadline - monotonic() - self.spin
+        if delay > 0:
+            time.sleep(delay)
+        while monotonic() < deadline:
+            pass
+
+    def run(self, start = None):
+        """
+        Execute the plan, from plan time start (the beginning of the
+        plan by default), until its end or until stop is called.
+        """
+        self.stopping.clear()
+        self.running = True
+        self._run(start)
+
+    def _run(self, start):
+        plan_start = self.plan.start if start is None else start
+        span = self.plan.end - plan_start
+        # One tick per period, plus one at the end of the plan if it
+        # does not fall on a period.
+        count = int(math.ceil(span * self.rate - 1e-9)) + 1
+        try:
+            begin = monotonic()
+            k = 0
+            while not self.stopping.is_set() and k < count:
+                offset = min(k * self.period, span)
+                deadline = begin + offset
+                self._wait(deadline)
+                now = monotonic()
+                late = now - deadline
+                self.jitter.record(late)
+                if self.policy == Policy.INTERPOLATE and late >= self.period:
+                    t = min(plan_start + late + offset, self.plan.end)
+                else:
+                    t = plan_start + offset
+                self.target(t, self.plan.interpolate(t))
+                self.latency.record(monotonic() - deadline)
+                self.ticks += 1
+                # Drop the ticks whose deadline already passed.
+                next_k = max(k + 1, int((monotonic() - begin) / self.period))
+                if k + 1 < count and next_k >= count:
+                    # Always finish on the last tick, at the end of the plan.
+                    next_k = count - 1
+                self.missed += next_k - k - 1
+                k = next_k
+        finally:
+            self.running = False
+
+    def start(self, start = None):
+        """Execute the plan in a background thread."""
+        def run():
+            try:
+                self._run(start)
+            except Exception, e:
+                self.logger.error("plan execution failed: %s" % e)
+                self.error = e
+        self.stopping.clear()
+        self.running = True
+        self.thread = threading.Thread(target = run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+
+    def wait(self, timeout = None):
+        if self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        """Return the tick counters and the jitter and latency summaries."""
+        return {'ticks': self.ticks, 'missed': self.missed,
+                'jitter': self.jitter.summary(),
+                'latency': self.latency.summary()}
+
+
+def _burn(stop):
+    while not stop.is_set():
+        pass
+
+class executorTest(unittest.TestCase):
+    """Check that a 250 Hz execution holds while every CPU is busy."""
+
+    rate = 250.
+    duration = 3.
+
+    def test(self):
+        import multiprocessing, numpy
+        from voodoo.plan import MovementPlan
+        times = numpy.arange(0., self.duration, 0.01)
+        plan = MovementPlan(times = times,
+                            states = numpy.random.rand(len(times), 30))
+        stop = multiprocessing.Event()
+        burners = [multiprocessing.Process(target = _burn, args = (stop,))
+                   for i in range(multiprocessing.cpu_count())]
+        for b in burners:
+            b.start()
+        try:
+            e = PlanExecutor(plan, lambda t, state: None, self.rate)
+            e.run()
+        finally:
+            stop.set()
+            for b in burners:
+                b.join()
+        s = e.stats()
+        print "%d ticks, %d missed, jitter p50 %.0fus p99 %.0fus " \
+            "max %.0fus" % (s['ticks'], s['missed'],
+                            s['jitter']['p50'] * 1e6,
+                            s['jitter']['p99'] * 1e6,
+                            s['jitter']['max'] * 1e6)
+        self.assertTrue(s['missed'] <= 0.01 * (s['ticks'] + s['missed']))
+        self.assertTrue(s['jitter']['p99'] < 1. / self.rate)
+
+__all__ = ["PlanExecutor", "Policy"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod(verbose=True)
+    unittest.main()
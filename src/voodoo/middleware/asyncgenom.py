@@ -0,0 +1,190 @@
+"""
+This module provides a non-blocking flavour of the Genom API.
+
+Every lifecycle method of AsyncGenom returns an Operation instead of
+blocking, and all processes are driven by a single Reactor: many
+hosts and components can be started or stopped concurrently from one
+thread.
+
+>>> from voodoo.middleware.reactor import Reactor, gather
+>>> r = Reactor ()
+>>> g = AsyncGenom (r)
+>>> r.run (g.start ())
+>>> r.run (gather ([g.startComponent (c) for c in ("walk", "pom")]))
+[None, None]
+>>> r.run (g.wait_ready (["walk", "pom"], 5.))
+>>> r.run (g.terminate ())
+"""
+import logging, os, subprocess
+
+from voodoo.middleware.genom import Genom, sshCommand
+from voodoo.middleware.readiness import \
+    ReadinessTimeout, moduleName, watcherScript
+from voodoo.middleware.reactor import \
+    Operation, Reactor, coroutine, gather
+from voodoo.middleware.ssh import pool as sshPool
+
+class AsyncGenom:
+    """
+    Genom instance whose lifecycle operations are asynchronous.
+    """
+
+    logger = logging.getLogger('voodoo.asyncgenom')
+
+    def __init__ (self, reactor = None):
+        self.reactor = reactor or Reactor ()
+        self.started = {}
+        self.tclserv = {}
+        self.components = {}
+
+    def _ssh (self, cmd, host, input = None):
+        return self.reactor.spawn (sshCommand (cmd, host), input)
+
+    def killall (self, prog, host="localhost"):
+        return self._ssh ("killall %s" % prog, host)
+
+    def killmodule (self, component, host="localhost"):
+        return self._ssh (Genom.commands["killmodule"] + " "
+                          + moduleName (component), host)
+
+    @coroutine
+    def start (self, host="localhost"):
+        """
+        Start Genom: initalize through h2 and start tclserv.
+        """
+        self.logger.info ("starting genom on %s" % host)
+        if self.started.get (host, None) == True:
+            self.logger.warning ("skipping as Genom is already started")
+            return
+
+        yield self.killall ("tclserv", host)
+        (st, out) = yield self._ssh (Genom.commands["h2"] + " init", host,
+                                     input = 'y\n')
+        if st:
+            self.logger.debug (out)
+            raise Exception ("failed to start h2 on %s" % host)
+
+        self.tclserv[host] = self.reactor.launch (
+            sshCommand (Genom.commands["tclserv"], host))
+        self.started[host] = True
+
+    @coroutine
+    def startComponent (self, component, host="localhost"):
+        """
+        Start Genom component. The operation is finished once the
+        process is launched, use wait_ready to wait for its registration.
+        """
+        yield gather ([self.killall (component, host),
+                       self.killmodule (component, host)])
+
+        self.logger.info ("starting component %s" % component)
+        output = open ("/tmp/%s.log" % moduleName (component), 'w')
+        (p, exited) = self.reactor.launch (sshCommand (component, host),
+                                           output)
+        exited.addCallback (lambda op: output.close ())
+        self.components[host + "/" + component] = (p, exited)
+
+    @coroutine
+    def stopComponent (self, component, host="localhost"):
+        """
+        Stop Genom component and wait for its process to exit.
+        """
+        self.logger.info ("stopping component %s" % component)
+        (st, out) = yield self.killmodule (component, host)
+        if st:
+            raise Exception ("failed to stop component %s (status = %d)"
+                             % (component, st))
+        (p, exited) = self.components.pop (host + "/" + component)
+        if not exited.done ():
+            p.terminate ()
+        yield exited
+
+    def wait_ready (self, components, timeout = 30.):
+        """
+        Return an operation finished once every component
+        (given as 'host/component', or 'component' for localhost)
+        has registered. It fails with ReadinessTimeout.
+        """
+        byHost = {}
+        for c in components:
+            (host, sep, name) = c.partition ('/')
+            if not sep or not host:
+                (host, name) = ("localhost", c)
+            byHost.setdefault (host, set ()).add (moduleName (name))
+
+        op = Operation ()
+        watchers = []
+        left = [len (byHost)]
+
+        def stop ():
+            for p in watchers:
+                if p.poll () is None:
+                    p.kill ()
+
+        def expired ():
+            stop ()
+            op.fail (ReadinessTimeout (
+                    sorted (h + "/" + n for (h, names) in byHost.iteritems ()
+                            for n in names), timeout))
+
+        def watch (host, names):
+            buf = [""]
+            def data (chunk):
+                lines = (buf[0] + chunk).split ("\n")
+                buf[0] = lines.pop ()
+                for name in lines:
+                    names.discard (name)
+            def exited (st):
+                if names:
+                    return
+                left[0] -= 1
+                if left[0] == 0:
+                    self.reactor.cancel (timer)
+                    op.resolve ()
+            p = subprocess.Popen (sshPool.command (host)
+                                  + [watcherScript (names)],
+                                  stdin = open (os.devnull),
+                                  stdout = subprocess.PIPE,
+                                  close_fds = True)
+            self.reactor.watch (p, data, exited)
+            watchers.append (p)
+
+        if not byHost:
+            op.resolve ()
+            return op
+        timer = self.reactor.callLater (timeout, expired)
+        for (host, names) in byHost.iteritems ():
+            watch (host, names)
+        return op
+
+    @coroutine
+    def terminate (self, host="localhost"):
+        """
+        Stop Genom: kill tclserv and call h2 end.
+        """
+        self.logger.info ("terminating Genom on %s" % host)
+        tclserv = self.tclserv.pop (host, None)
+        if tclserv:
+            (p, exited) = tclserv
+            if not exited.done ():
+                p.terminate ()
+            yield exited
+
+        (st, out) = yield self._ssh (Genom.commands["h2"] + " info", host)
+        if st != 3:
+            (st, out) = yield self._ssh (Genom.commands["h2"] + " end", host)
+            if st:
+                raise Exception ("Failed to terminate h2 on %s" % host)
+        self.started[host] = False
+
+    def run (self, op, timeout = None):
+        """Run the reactor until op is finished and return its result."""
+        return self.reactor.run (op, timeout)
+
+
+__all__ = ["AsyncGenom"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
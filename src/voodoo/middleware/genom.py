@@ -7,7 +7,16 @@ It allows locally or remotely:
 It should wrap transparently all Genom-related activities
 and provide a consistant and reentrant API for the user.
 """
-import StringIO, logging, os, subprocess
+import StringIO, logging, os, pipes, subprocess, time
+
+from voodoo.middleware.logs import LogPump
+from voodoo.middleware.readiness import \
+    ReadinessTimeout, moduleName, waitReady
+from voodoo.middleware.ssh import pool as sshPool
+from voodoo.middleware.standby import StandbyPool
+from voodoo.middleware.supervisor import Supervisor
+from voodoo.middleware.teardown import teardownHost
+from voodoo.util.parallel import parallel_map
 
 def getGenomPath ():
     """
@@ -61,27 +70,35 @@ def call (prog, stdout = subprocess.PIPE):
                             stderr = subprocess.STDOUT)
 
 
+def sshCommand (cmd, host="localhost"):
+    """
+    Build the command line running cmd on host with the Genom path.
+
+    >>> sshCommand ("true")[-1].endswith (" true'")
+    True
+    """
+    return sshPool.command (host) + \
+        ["sh -c 'PATH=\'%s:$PATH\' %s'" % (getGenomPath (), cmd)]
+
 def sshLaunch (cmd, stdout = subprocess.PIPE, host="localhost"):
     """
     Use ssh to launch processes remotely.
+    The connection is shared with other commands to the same host,
+    see voodoo.middleware.ssh.
 
     >>> x = sshLaunch ("true")
     """
-    return launch (["ssh", "-X", host,
-                    "sh -c 'PATH=\'%s:$PATH\' %s'"
-                    % (getGenomPath (), cmd)],
-                   stdout=stdout)
+    return launch (sshCommand (cmd, host), stdout=stdout)
 
 def sshCall (cmd, stdout = subprocess.PIPE, host="localhost"):
     """
     Use ssh to execute a program remotely.
+    The connection is shared with other commands to the same host,
+    see voodoo.middleware.ssh.
 
     >>> x = sshCall ("true")
     """
-    return call (["ssh", "-X", host,
-                  "sh -c 'PATH=\'%s:$PATH\' %s'"
-                  % (getGenomPath (), cmd)],
-                 stdout=stdout)
+    return call (sshCommand (cmd, host), stdout=stdout)
 
 
 def killall (prog, host="localhost"):
@@ -90,15 +107,60 @@ def killall (prog, host="localhost"):
 
     >>> x = killall ("true")
     """
-    return sshCall ("killall %s" % prog)
+    return sshCall ("killall %s" % prog, host=host)
 
 
+def startScript (components, killmodule = "killmodule"):
+    """
+    Generate a shell script starting several components on a host.
+    The script cleans up previous instances, launches every component
+    with its output in /tmp/<component>.log on that host and reports
+    'pid <component> <pid>' for each of them. It then waits for the
+    components and reports 'exit <component> <status>' as each exits.
+
+    >>> print startScript (["viam", "/opt/bin/nmbt"]) #doctest: +ELLIPSIS
+    PATH=...:$PATH; export PATH
+    killall viam nmbt >/dev/null 2>&1
+    killmodule viam >/dev/null 2>&1
+    killmodule nmbt >/dev/null 2>&1
+    (viam </dev/null >/tmp/viam.log 2>&1 & echo pid viam $!; wait $!; echo exit viam $?) &
+    (/opt/bin/nmbt </dev/null >/tmp/nmbt.log 2>&1 & echo pid nmbt $!; wait $!; echo exit nmbt $?) &
+    wait
+    """
+    names = [moduleName (c) for c in components]
+    lines = ["PATH=%s:$PATH; export PATH" % pipes.quote (getGenomPath ()),
+             "killall %s >/dev/null 2>&1" % " ".join (names)]
+    lines += ["%s %s >/dev/null 2>&1" % (killmodule, n) for n in names]
+    for (c, n) in zip (components, names):
+        lines.append ("(%s </dev/null >/tmp/%s.log 2>&1 & echo pid %s $!; "
+                      "wait $!; echo exit %s $?) &" % (c, n, n, n))
+    lines.append ("wait")
+    return "\n".join (lines)
+
 def module_ready(component):
     from socket import gethostname
     host = gethostname()
     return os.access(os.getenv("HOME") + "/." + component + ".pid-" + host,
                      os.F_OK)
 
+class MultiHostError(Exception):
+    """
+    Raised when an operation run on several hosts fails on some of them.
+    Results of the hosts which succeeded are kept in results,
+    exceptions of the ones which failed in errors.
+
+    >>> e = MultiHostError ({"a": None}, {"b": Exception ("boom")})
+    >>> str (e)
+    'failed on 1 host(s): b: boom'
+    """
+    def __init__ (self, results, errors):
+        Exception.__init__ (self, "failed on %d host(s): %s"
+                            % (len (errors),
+                               ", ".join ("%s: %s" % (h, errors[h])
+                                          for h in sorted (errors))))
+        self.results = results
+        self.errors = errors
+
 class Genom:
     """
     This class represents an instance of Genom. It
@@ -131,34 +193,44 @@ class Genom:
 
     logger = logging.getLogger('voodoo.genom')
 
-    def __init__ (self):
+    def __init__ (self, batch = False):
         """
         Initialize class and create the logger.
+        If batch is true, components are started through a single
+        remote script each (see startComponents).
 
         >>> g = Genom ()
         """
         self.started = {}
-        self.tclserv = None
+        self.tclserv = {}
         self.components = {}
-        pass
+        self.pids = {}
+        self.batch = batch
+        self.standby = StandbyPool (getGenomPath)
+        self.launched = {}
+        self.logs = LogPump ()
+        self.supervisor = None
+        self.teardownDeadline = 2.
+        self.teardownReports = {}
 
     def __enter__(self):
         self.start()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.terminate()
+        try:
+            self.terminate_all()
+        finally:
+            self.logs.close ()
         return self
 
-    def dumpLogs (self):
-        """Dump module logs.
-        Block if module has not been terminated beforehand."""
-        for (name, p) in self.components.iteritems ():
+    def dumpLogs (self, n = None):
+        """Dump the last n lines (all buffered lines if None) of the
+        module logs. Does not block, see voodoo.middleware.logs."""
+        for name in self.logs.names ():
             print "--- " + name + " ---"
-            print "STDOUT:"
-            print p.stdout.read ()
-            print "STDERR:"
-            print p.stderr.read ()
+            for line in self.logs.tail (name, n):
+                print line
 
     def killmodule (self, component, host="localhost"):
         """
@@ -173,7 +245,8 @@ class Genom:
         if len (module):
             component = module[len (module) - 1]
         self.logger.debug ("killing module %s" % component)
-        return sshCall (Genom.commands["killmodule"] + " " + component, host)
+        return sshCall (Genom.commands["killmodule"] + " " + component,
+                        host=host)
 
     def start (self, host="localhost"):
         """
@@ -182,24 +255,42 @@ class Genom:
         >>> g = Genom ()
         >>> g.start ()
         """
-        self.logger.info ("starting genom")
+        self.logger.info ("starting genom on %s" % host)
 
         if self.started.get (host, None) == True:
             self.logger.warning ("skipping as Genom is already started")
+            return
 
-        killall (host, "tclserv")
+        killall ("tclserv", host)
 
-        p = sshLaunch (Genom.commands["h2"] + " init", host)
+        p = sshLaunch (Genom.commands["h2"] + " init", host=host)
         p.communicate(input='y\n')
         if (p.wait ()):
-            raise Exception ("failed to start h2")
-
-        self.tclserv = sshLaunch (Genom.commands["tclserv"], host)
-        if self.tclserv.returncode:
-            self.logger.debug (self.tclserv.stdout.read ())
-            self.logger.debug (self.tclserv.stderr.read ())
-            raise Exception ("failed to start tclserv")
+            raise Exception ("failed to start h2 on %s" % host)
+
+        tclserv = sshLaunch (Genom.commands["tclserv"], host=host)
+        if tclserv.returncode:
+            self.logger.debug (tclserv.stdout.read ())
+            raise Exception ("failed to start tclserv on %s" % host)
+        self.logs.register (host + "/tclserv", tclserv.stdout)
+        self.tclserv[host] = tclserv
         self.started[host] = True
+        self.standby.resume ()
+
+    def start_all (self, hosts, workers = None):
+        """
+        Start Genom on several hosts at once.
+        Return a dictionary of per-host results, raise MultiHostError
+        if any host failed (the other hosts are left started).
+
+        >>> g = Genom ()
+        >>> g.start_all (["localhost"])
+        {'localhost': None}
+        """
+        (results, errors) = parallel_map (self.start, hosts, workers)
+        if errors:
+            raise MultiHostError (results, errors)
+        return results
 
     def startComponent (self, component, host="localhost"):
         """
@@ -209,18 +300,121 @@ class Genom:
         >>> g.start ()
         >>> g.startComponent ("walk")
         """
+        begin = time.time ()
+        key = host + "/" + component
+        if self.batch and not self.standby.counts.get (key, 0):
+            return self.startComponents ([component], host)
+
         killall (component, host)
         self.killmodule (component, host)
 
-        self.logger.info ("starting component %s" % component)
-
-        stdout = "/tmp/%s.log" % component
-        p = sshLaunch (component, stdout, host)
+        p = self.standby.promote (component, host)
+        if p:
+            self.logger.info ("promoting standby of component %s" % component)
+            self.launched[key] = (begin, "promote")
+        else:
+            self.logger.info ("starting component %s" % component)
+            p = sshLaunch (component, host=host)
+            self.launched[key] = (begin, "cold")
         if p.returncode:
             raise Exception ("failed to start component %s (status = %d)" % p.returncode)
-        self.components[host + "/" + component] = p
+        self.logs.register (key, p.stdout,
+                            "/tmp/%s.log" % moduleName (component))
+        self.components[key] = p
+        if self.supervisor:
+            self.supervisor.watch (key, p)
+
+    def supervise (self, restart = True, **options):
+        """
+        Supervise the components started from now on: exits are
+        detected as they happen and crashed components are restarted
+        with a backoff unless restart is false.
+        Options are forwarded to voodoo.middleware.supervisor.Supervisor.
+        Return the supervisor, whose subscribe method gives access to
+        the lifecycle events.
+
+        >>> g = Genom ()
+        >>> events = g.supervise ().subscribe ()
+        """
+        if not self.supervisor:
+            self.supervisor = Supervisor (
+                restart and self.startComponent or None, **options)
+            self.supervisor.start ()
+        return self.supervisor
+
+    def setStandby (self, component, count, host="localhost"):
+        """
+        Keep count pre-spawned standby processes of a component,
+        promoted by startComponent and replenished in the background.
+        See voodoo.middleware.standby.
+
+        >>> g = Genom ()
+        >>> g.setStandby ("walk", 1)
+        >>> g.start ()
+        >>> g.startComponent ("walk")
+        >>> g.wait_ready ("walk")
+        >>> g.standbyStats ()["promote"]["count"]
+        1
+        >>> g.terminate ()
+        """
+        self.standby.setCount (component, count, host)
+
+    def standbyStats (self):
+        """
+        Return the launch-to-ready latency statistics of components
+        started from a standby ('promote') or not ('cold').
+        """
+        return self.standby.stats ()
+
+    def startComponents (self, components, host="localhost"):
+        """
+        Start several components on a host with a single remote
+        execution: cleanup, launch and pid capture of all the components
+        are done by one generated script (see startScript).
+        The component logs are written in /tmp/<component>.log on host.
+        The ssh session is shared by the components and ends when they
+        have all exited.
+
+        >>> g = Genom ()
+        >>> g.start ()
+        >>> g.startComponents (["walk", "pom"])
+        """
+        self.logger.info ("starting components %s on %s"
+                          % (", ".join (components), host))
+        p = launch (sshPool.command (host) + ["sh -s"])
+        p.stdin.write (startScript (components, Genom.commands["killmodule"]))
+        p.stdin.close ()
+
+        pids = {}
+        exits = []
+        while len (pids) < len (components):
+            line = p.stdout.readline ()
+            if not line:
+                raise Exception ("failed to start components %s (status = %s)"
+                                 % (", ".join (components), p.wait ()))
+            words = line.split ()
+            if len (words) == 3 and words[0] == "pid":
+                pids[words[1]] = int (words[2])
+            elif len (words) == 3 and words[0] == "exit":
+                exits.append (words)
+        for c in components:
+            key = host + "/" + c
+            self.components[key] = p
+            self.pids[key] = pids[moduleName (c)]
+            if self.supervisor:
+                self.supervisor.watch (key)
+
+        names = dict ((moduleName (c), c) for c in components)
+        def exited (line):
+            words = line.split ()
+            if len (words) == 3 and words[0] == "exit" and self.supervisor:
+                self.supervisor.exited (host + "/" + names[words[1]],
+                                        int (words[2]))
+        for words in exits:
+            exited (" ".join (words))
+        self.logs.register (host + "/batch-%d" % p.pid, p.stdout,
+                            onLine = exited)
 
-    # FIXME: broken.
     def stopComponent (self, component, host="localhost"):
         """
         Stop Genom component.
@@ -228,45 +422,120 @@ class Genom:
         >>> g = Genom ()
         >>> g.start ()
         >>> g.startComponent ("walk")
-        >>> # g.stopComponent ("walk")
+        >>> g.stopComponent ("walk")
         """
+        key = host + "/" + component
         self.logger.info ("stopping component %s" % component)
-        st = self.killmodule (host + "/" + component)
+        if self.supervisor:
+            self.supervisor.expect (key)
+        st = self.killmodule (component, host)
         if st:
             raise Exception ("failed to stop component %s (status = %d)"
                              % (component, st))
-        p = self.components[host + "/" + component]
-        if p.returncode:
+        p = self.components.pop (key)
+        if self.pids.pop (key, None) is not None:
+            # Started by a batch: the session is shared with the other
+            # components and ends by itself with the last one.
+            return
+        if p.poll () is None:
             p.terminate ()
-            p.kill ()
         st = p.wait ()
-        if st:
-            self.logger.debug (p.stdout.read ())
-            self.logger.debug (p.stderr.read ())
+        # A negative status means the session was terminated above.
+        if st > 0:
+            self.logger.debug ("\n".join (self.logs.tail (key, 20)))
             raise Exception ("error while terminating component %s (status = %d)"
                              % (component, st))
 
-    def terminate (self):
+    def wait_ready (self, component, timeout = 30., host="localhost"):
         """
-        Stop Genom: kill tclserv and call h2 end.
+        Block until a component has registered its pid file.
+        Raise ReadinessTimeout if it is not ready after timeout seconds.
 
         >>> g = Genom ()
         >>> g.start ()
-        >>> g.terminate ()
+        >>> g.startComponent ("walk")
+        >>> g.wait_ready ("walk", 5.)
+        """
+        key = host + "/" + component
+        waitReady ([key], timeout)
+        if key in self.launched:
+            (begin, kind) = self.launched.pop (key)
+            self.standby.record (kind, time.time () - begin)
+
+    def wait_ready_all (self, components, timeout = 30.):
         """
-        self.logger.info ("terminating Genom")
-        if self.tclserv:
-            self.tclserv.terminate ()
-            self.tclserv.kill ()
+        Block until several components are ready.
+        Components are given as 'host/component', or 'component'
+        for localhost. A single watcher is used per remote host.
 
-        p = launch (["h2", "info"])
-        if p.wait () != 3:
-            p = launch (["h2", "end"])
-            if (p.wait ()):
-                raise Exception ("Failed to terminate h2")
+        >>> g = Genom ()
+        >>> g.wait_ready_all ([])
+        """
+        waitReady (components, timeout)
 
+    def terminate (self, host="localhost"):
+        """
+        Stop Genom: kill tclserv and the components of the host
+        and call h2 end, all through a single remote script (see
+        voodoo.middleware.teardown). Processes still alive after
+        teardownDeadline seconds are killed.
+        The report of the teardown is kept in teardownReports.
 
-__all__ = ["Genom", "module_ready"]
+        >>> g = Genom ()
+        >>> g.start ()
+        >>> g.terminate ()
+        >>> g.teardownReports["localhost"]["h2"]
+        'ended'
+        """
+        self.logger.info ("terminating Genom on %s" % host)
+        keys = [k for k in self.components.keys ()
+                if k.split ('/', 1)[0] == host]
+        if self.supervisor:
+            for key in keys:
+                self.supervisor.expect (key)
+        names = [Genom.commands["tclserv"]] + \
+            [k.split ('/', 1)[1] for k in keys]
+
+        self.teardownReports[host] = teardownHost (
+            host, names, getGenomPath (), self.teardownDeadline,
+            Genom.commands["h2"])
+
+        # The local sessions end with their remote processes.
+        sessions = [self.tclserv.pop (host, None)]
+        for key in keys:
+            sessions.append (self.components.pop (key))
+            self.pids.pop (key, None)
+        for p in sessions:
+            if p and p.poll () is None:
+                p.terminate ()
+                p.wait ()
+        self.started[host] = False
+
+    def terminate_all (self, workers = None):
+        """
+        Stop Genom on every started host at once.
+        Raise MultiHostError if any host failed.
+
+        >>> g = Genom ()
+        >>> g.start_all (["localhost"])
+        {'localhost': None}
+        >>> g.terminate_all ()
+        {'localhost': None}
+        """
+        self.standby.clear ()
+        hosts = [h for (h, st) in self.started.iteritems () if st]
+        if not hosts:
+            hosts = ["localhost"]
+        (results, errors) = parallel_map (self.terminate, hosts, workers)
+        # Flush and close the spilled logs; the pump starts again if
+        # components are started again.
+        self.logs.stop ()
+        if errors:
+            raise MultiHostError (results, errors)
+        return results
+
+
+__all__ = ["Genom", "MultiHostError", "ReadinessTimeout", "module_ready"]
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,198 @@
+"""
+This module starts a set of Genom components following their
+declared dependencies.
+
+Components whose dependencies are all ready form a level: every
+component of a level is started in parallel on its host, and the
+next level is started once the whole level is ready.
+Teardown stops the levels in reverse order.
+
+The time from launch to readiness of each component is recorded and
+the critical path of the bring-up (the chain of dependencies which
+took the longest) is reported.
+
+>>> from voodoo.middleware.genom import Genom
+>>> graph = ComponentGraph ()
+>>> graph.add ("viam")
+>>> graph.add ("nmbt", depends = ["viam"])
+>>> with Genom () as g:
+...     with Launcher (g, graph) as l:
+...         (duration, path) = l.criticalPath ()
+"""
+import logging, time
+
+from voodoo.util.parallel import parallel_map
+
+def componentKey (component, host="localhost", hosts=()):
+    """
+    Return the 'host/component' key of a component of host. A
+    component given as 'host/component' is split only if its first
+    part is one of hosts: other paths are components of host.
+
+    >>> componentKey ("viam")
+    'localhost/viam'
+    >>> componentKey ("hrp2/walk", hosts = ["hrp2"])
+    'hrp2/walk'
+    >>> componentKey ("bin/viam", hosts = ["hrp2"])
+    'localhost/bin/viam'
+    """
+    if component.split ('/', 1)[0] in hosts and '/' in component:
+        return component
+    return host + "/" + component
+
+class ComponentGraph:
+    """
+    Dependency graph of components, identified as 'host/component'.
+
+    >>> g = ComponentGraph ()
+    >>> g.add ("viam")
+    >>> g.add ("nmbt", depends = ["viam"])
+    >>> g.add ("walk", "hrp2")
+    >>> g.add ("sot", "hrp2", ["hrp2/walk", "nmbt"])
+    >>> g.levels ()
+    [['hrp2/walk', 'localhost/viam'], ['localhost/nmbt'], ['hrp2/sot']]
+    >>> g.add ("bin/pom", depends = ["bin/viam"])
+    >>> g.depends["localhost/bin/pom"]
+    ['localhost/bin/viam']
+    """
+
+    def __init__ (self):
+        self.depends = {}
+        # Dependencies as declared, resolved again once a host is added.
+        self.declared = {}
+        self.hosts = set ()
+
+    def add (self, component, host="localhost", depends=()):
+        """
+        Declare a component running on host. Dependencies are
+        components started on localhost, or given as 'host/component'
+        where host is the host of a declared component.
+        """
+        self.hosts.add (host)
+        self.declared[componentKey (component, host)] = list (depends)
+        self.depends = dict ((key, [componentKey (d, hosts = self.hosts)
+                                    for d in deps])
+                             for (key, deps) in self.declared.iteritems ())
+
+    def levels (self):
+        """
+        Return the components grouped by topological level.
+        Raise an exception on unknown dependencies or cycles.
+        """
+        left = {}
+        for (key, deps) in self.depends.iteritems ():
+            for d in deps:
+                if d not in self.depends:
+                    raise Exception ("component %s depends on unknown %s"
+                                     % (key, d))
+            left[key] = set (deps)
+        res = []
+        while left:
+            level = sorted (k for (k, deps) in left.iteritems () if not deps)
+            if not level:
+                raise Exception ("dependency cycle between %s"
+                                 % ", ".join (sorted (left)))
+            for k in level:
+                del left[k]
+            for deps in left.itervalues ():
+                deps.difference_update (level)
+            res.append (level)
+        return res
+
+
+class Launcher:
+    """
+    Start and stop the components of a graph through a Genom instance.
+    """
+
+    logger = logging.getLogger('voodoo.launcher')
+
+    def __init__ (self, genom, graph, timeout = 30.):
+        self.genom = genom
+        self.graph = graph
+        self.timeout = timeout
+        self.started = []
+        self.durations = {}
+
+    def __enter__ (self):
+        self.launch ()
+        return self
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        self.teardown ()
+        return False
+
+    def _start (self, key):
+        (host, component) = key.split ('/', 1)
+        begin = time.time ()
+        self.genom.startComponent (component, host)
+        self.genom.wait_ready (component, self.timeout, host)
+        self.durations[key] = time.time () - begin
+
+    def _stop (self, key):
+        (host, component) = key.split ('/', 1)
+        self.genom.stopComponent (component, host)
+
+    def launch (self):
+        """
+        Start every component, level by level.
+        On failure, the components already started are stopped.
+        """
+        try:
+            for level in self.graph.levels ():
+                self.logger.info ("starting %s" % ", ".join (level))
+                (results, errors) = parallel_map (self._start, level)
+                # Components which did not become ready may still run.
+                self.started.append (level)
+                if errors:
+                    raise Exception ("failed to start %s"
+                                     % ", ".join ("%s (%s)" % (k, errors[k])
+                                                  for k in sorted (errors)))
+        except:
+            self.teardown ()
+            raise
+        (duration, path) = self.criticalPath ()
+        self.logger.info ("critical path: %s (%.3fs)"
+                          % (" -> ".join (path), duration))
+
+    def teardown (self):
+        """Stop the started components in reverse order."""
+        errors = {}
+        while self.started:
+            level = self.started.pop ()
+            self.logger.info ("stopping %s" % ", ".join (level))
+            errors.update (parallel_map (self._stop, level)[1])
+        for (key, e) in sorted (errors.iteritems ()):
+            self.logger.warning ("failed to stop %s: %s" % (key, e))
+
+    def criticalPath (self):
+        """
+        Return the total duration of the slowest dependency chain
+        and the components along it, from first to last started.
+        The duration of a component spans from its launch to its
+        readiness.
+        """
+        total = {}
+        previous = {}
+        for level in self.graph.levels ():
+            for key in level:
+                deps = self.graph.depends[key]
+                before = max ([(total[d], d) for d in deps] or [(0., None)])
+                total[key] = before[0] + self.durations.get (key, 0.)
+                previous[key] = before[1]
+        if not total:
+            return (0., [])
+        (duration, key) = max ((t, k) for (k, t) in total.iteritems ())
+        path = []
+        while key:
+            path.insert (0, key)
+            key = previous[key]
+        return (duration, path)
+
+
+__all__ = ["ComponentGraph", "Launcher"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
@@ -0,0 +1,376 @@
+"""
+This module captures the output of Genom processes without blocking.
+
+A single background thread (LogPump) drains every registered stream.
+The last lines of each stream are kept in a bounded in-memory ring
+buffer and can be queried at any time (tail, grep, since) while the
+process is running. Lines can also be spilled to rotating files with
+buffered writes.
+"""
+import collections, errno, fcntl, logging, os, re, select, threading, time
+
+class RingBuffer:
+    """
+    Bounded buffer of timestamped lines.
+
+    >>> b = RingBuffer (2)
+    >>> for (t, l) in ((1., "a"), (2., "b"), (3., "c")):
+    ...     b.append (l, t)
+    >>> b.tail ()
+    ['b', 'c']
+    >>> b.since (2.5)
+    ['c']
+    >>> b.grep ("[ab]")
+    ['b']
+    >>> b.dropped
+    1
+    """
+
+    def __init__ (self, size = 1000):
+        self.lines = collections.deque (maxlen = size)
+        self.dropped = 0
+        self.lock = threading.Lock ()
+
+    def append (self, line, timestamp = None):
+        self.lock.acquire ()
+        try:
+            if len (self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append ((timestamp or time.time (), line))
+        finally:
+            self.lock.release ()
+
+    def entries (self):
+        """Return a copy of the (timestamp, line) pairs."""
+        self.lock.acquire ()
+        try:
+            return list (self.lines)
+        finally:
+            self.lock.release ()
+
+    def tail (self, n = None):
+        lines = [l for (t, l) in self.entries ()]
+        if n is None:
+            return lines
+        return lines[-n:] if n else []
+
+    def since (self, timestamp):
+        return [l for (t, l) in self.entries () if t >= timestamp]
+
+    def grep (self, pattern):
+        regexp = re.compile (pattern)
+        return [l for (t, l) in self.entries () if regexp.search (l)]
+
+
+class RotatingLog:
+    """
+    Buffered log file rotated once it exceeds maxBytes.
+    Rotated files are named path.1 (most recent) to path.<backups>.
+    If append is true, an existing file at path is continued.
+    """
+
+    def __init__ (self, path, maxBytes = 10 << 20, backups = 3,
+                  buffering = 1 << 16, append = False):
+        self.path = path
+        self.maxBytes = maxBytes
+        self.backups = backups
+        self.buffering = buffering
+        self.file = open (path, 'a' if append else 'w', buffering)
+        self.size = os.path.getsize (path) if append else 0
+
+    def write (self, data):
+        if self.maxBytes and self.size + len (data) > self.maxBytes \
+                and self.size:
+            self.rotate ()
+        self.file.write (data)
+        self.size += len (data)
+
+    def rotate (self):
+        self.file.close ()
+        for i in range (self.backups - 1, 0, -1):
+            if os.path.exists ("%s.%d" % (self.path, i)):
+                os.rename ("%s.%d" % (self.path, i),
+                           "%s.%d" % (self.path, i + 1))
+        if self.backups:
+            os.rename (self.path, self.path + ".1")
+        self.file = open (self.path, 'w', self.buffering)
+        self.size = 0
+
+    def flush (self):
+        self.file.flush ()
+
+    def close (self):
+        self.file.close ()
+
+
+class LogPump:
+    """
+    Background thread draining process outputs into ring buffers.
+
+    >>> import subprocess
+    >>> pump = LogPump ()
+    >>> p = subprocess.Popen (["echo", "hello"], stdout = subprocess.PIPE)
+    >>> pump.register ("echo", p.stdout)
+    >>> pump.wait ("echo", 5.)
+    True
+    >>> pump.tail ("echo")
+    ['hello']
+    >>> pump.stop ()
+
+    Streams stay registered across a restart, and keep spilling:
+
+    >>> import tempfile
+    >>> path = tempfile.mktemp ()
+    >>> (r, w) = os.pipe ()
+    >>> pump.register ("pipe", r, spill = path)
+    >>> os.write (w, "a\\n")
+    2
+    >>> while not pump.tail ("pipe"):
+    ...     time.sleep (0.01)
+    >>> pump.stop ()
+    >>> os.write (w, "b\\n")
+    2
+    >>> os.close (w)
+    >>> p = subprocess.Popen (["true"], stdout = subprocess.PIPE)
+    >>> pump.register ("true", p.stdout)
+    >>> pump.wait ("pipe", 5.)
+    True
+    >>> pump.close ()
+    >>> (pump.tail ("pipe"), open (path).read ())
+    (['a', 'b'], 'a\\nb\\n')
+    >>> os.remove (path)
+    """
+
+    logger = logging.getLogger('voodoo.logs')
+
+    def __init__ (self, size = 1000, flushInterval = 1.):
+        self.size = size
+        self.flushInterval = flushInterval
+        self.buffers = {}
+        self.streams = {}
+        # Spill files by name, and their paths, kept to reopen the
+        # files once the pump restarts.
+        self.spills = {}
+        self.spillPaths = {}
+        self.closed = {}
+        self.lock = threading.Lock ()
+        self.condition = threading.Condition (self.lock)
+        # Serializes starting and stopping the pump thread, so that
+        # at most one thread drains the streams.
+        self.control = threading.Lock ()
+        self.thread = None
+        self.running = False
+        (self.wakeup, self.wakeupWrite) = os.pipe ()
+        self._nonBlocking (self.wakeup)
+
+    def _nonBlocking (self, fd):
+        flags = fcntl.fcntl (fd, fcntl.F_GETFL)
+        fcntl.fcntl (fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def buffer (self, name):
+        self.lock.acquire ()
+        try:
+            b = self.buffers.get (name, None)
+            if b is None:
+                b = self.buffers[name] = RingBuffer (self.size)
+            return b
+        finally:
+            self.lock.release ()
+
+    def register (self, name, stream, spill = None, onLine = None):
+        """
+        Drain stream (a file object or descriptor) into the buffer
+        of name. If spill is a path, lines are also written to a
+        rotating log file there. onLine, if given, is called from the
+        pump thread with every line.
+        """
+        fd = stream if type (stream) == int else stream.fileno ()
+        self._nonBlocking (fd)
+        b = self.buffer (name)
+        self.control.acquire ()
+        try:
+            self.lock.acquire ()
+            try:
+                if spill:
+                    old = self.spills.pop (name, None)
+                    if old:
+                        old.close ()
+                    self.spills[name] = RotatingLog (spill)
+                    self.spillPaths[name] = spill
+                self.streams[fd] = [name, b, stream, "", onLine]
+                self.closed[name] = False
+                if not self.thread:
+                    self.running = True
+                    self.thread = threading.Thread (target = self._run)
+                    self.thread.daemon = True
+                    self.thread.start ()
+            finally:
+                self.lock.release ()
+        finally:
+            self.control.release ()
+        os.write (self.wakeupWrite, "x")
+
+    def _spill (self, name):
+        """Return the spill file of name, reopened after a restart."""
+        self.lock.acquire ()
+        try:
+            spill = self.spills.get (name, None)
+            path = self.spillPaths.get (name, None)
+            if spill is None and path:
+                spill = self.spills[name] = RotatingLog (path, append = True)
+            return spill
+        finally:
+            self.lock.release ()
+
+    def _read (self, fd):
+        entry = self.streams[fd]
+        (name, b, stream, partial, onLine) = entry
+        try:
+            data = os.read (fd, 65536)
+        except OSError, e:
+            if e.errno == errno.EAGAIN:
+                return
+            data = ""
+        spill = self._spill (name)
+        if not data:
+            if partial:
+                b.append (partial)
+                if spill:
+                    spill.write (partial + "\n")
+            self.lock.acquire ()
+            try:
+                del self.streams[fd]
+                self.closed[name] = True
+                self.condition.notifyAll ()
+            finally:
+                self.lock.release ()
+            if spill:
+                spill.flush ()
+            if type (stream) == int:
+                os.close (fd)
+            else:
+                stream.close ()
+            return
+        if spill:
+            spill.write (data)
+        lines = (partial + data).split ("\n")
+        entry[3] = lines.pop ()
+        now = time.time ()
+        for line in lines:
+            b.append (line, now)
+            if onLine:
+                try:
+                    onLine (line)
+                except Exception, e:
+                    self.logger.warning ("line handler of %s failed: %s"
+                                         % (name, e))
+
+    def _run (self):
+        lastFlush = time.time ()
+        while True:
+            self.lock.acquire ()
+            try:
+                if not self.running:
+                    break
+                fds = self.streams.keys () + [self.wakeup]
+            finally:
+                self.lock.release ()
+            try:
+                (r, w, x) = select.select (fds, [], [], self.flushInterval)
+            except select.error, e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in r:
+                if fd == self.wakeup:
+                    try:
+                        os.read (self.wakeup, 4096)
+                    except OSError:
+                        pass
+                elif fd in self.streams:
+                    self._read (fd)
+            now = time.time ()
+            if now - lastFlush >= self.flushInterval:
+                self.lock.acquire ()
+                try:
+                    spills = self.spills.values ()
+                finally:
+                    self.lock.release ()
+                for spill in spills:
+                    spill.flush ()
+                lastFlush = now
+
+    def wait (self, name, timeout = None):
+        """
+        Wait until the stream of name is closed.
+        Return False if it is still open after timeout.
+        """
+        deadline = None if timeout is None else time.time () + timeout
+        self.condition.acquire ()
+        try:
+            while not self.closed.get (name, True):
+                left = None if deadline is None else deadline - time.time ()
+                if left is not None and left <= 0:
+                    return False
+                self.condition.wait (left)
+            return True
+        finally:
+            self.condition.release ()
+
+    def names (self):
+        return sorted (self.buffers.keys ())
+
+    def tail (self, name, n = None):
+        """Return the last n lines of name (all buffered lines if None)."""
+        return self.buffer (name).tail (n)
+
+    def grep (self, name, pattern):
+        """Return the buffered lines of name matching pattern."""
+        return self.buffer (name).grep (pattern)
+
+    def since (self, name, timestamp):
+        """Return the buffered lines of name received after timestamp."""
+        return self.buffer (name).since (timestamp)
+
+    def stop (self):
+        """
+        Stop the pump thread and close the spill files. Registered
+        streams are kept: the next register restarts the pump, and
+        spilling resumes at the end of the same files.
+        """
+        self.control.acquire ()
+        try:
+            self.lock.acquire ()
+            try:
+                self.running = False
+                thread = self.thread
+            finally:
+                self.lock.release ()
+            os.write (self.wakeupWrite, "x")
+            if thread:
+                thread.join ()
+            self.lock.acquire ()
+            try:
+                self.thread = None
+                spills = self.spills.values ()
+                self.spills = {}
+            finally:
+                self.lock.release ()
+            for spill in spills:
+                spill.close ()
+        finally:
+            self.control.release ()
+
+    def close (self):
+        """Stop the pump for good, releasing its wakeup pipe."""
+        self.stop ()
+        for fd in (self.wakeup, self.wakeupWrite):
+            os.close (fd)
+
+
+__all__ = ["LogPump", "RingBuffer", "RotatingLog"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
@@ -0,0 +1,285 @@
+"""
+This module provides a minimal single-threaded event loop
+driving many subprocesses at once.
+
+Operations are deferred results. Coroutines are generators yielding
+operations: the reactor resumes them with the result once the
+operation completes, so that hundreds of processes can be waited on
+concurrently without a thread per process.
+
+>>> r = Reactor ()
+>>> @coroutine
+... def twice ():
+...     (st1, out1) = yield r.spawn (["echo", "a"])
+...     (st2, out2) = yield r.spawn (["echo", "b"])
+...     raise Return (out1 + out2)
+>>> r.run (twice ())
+'a\\nb\\n'
+>>> r.run (gather ([r.spawn (["true"]), r.spawn (["false"])]))
+[(0, ''), (1, '')]
+"""
+import errno, fcntl, heapq, itertools, logging, os, select, subprocess, time
+
+class Operation:
+    """
+    The result of an asynchronous operation.
+
+    >>> op = Operation ()
+    >>> op.done ()
+    False
+    >>> op.addCallback (lambda o: o.value)
+    >>> op.resolve (42)
+    >>> op.result ()
+    42
+    """
+
+    def __init__ (self):
+        self.finished = False
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    def done (self):
+        return self.finished
+
+    def _finish (self):
+        self.finished = True
+        (callbacks, self.callbacks) = (self.callbacks, [])
+        for cb in callbacks:
+            cb (self)
+
+    def resolve (self, value = None):
+        if self.finished:
+            return
+        self.value = value
+        self._finish ()
+
+    def fail (self, error):
+        if self.finished:
+            return
+        self.error = error
+        self._finish ()
+
+    def addCallback (self, cb):
+        """Call cb (operation) once the operation is finished."""
+        if self.finished:
+            cb (self)
+        else:
+            self.callbacks.append (cb)
+
+    def result (self):
+        if not self.finished:
+            raise Exception ("operation is not finished")
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class Return(Exception):
+    """Raised by a coroutine to return a value."""
+    def __init__ (self, value = None):
+        Exception.__init__ (self)
+        self.value = value
+
+
+def coroutine (fn):
+    """
+    Turn a generator function yielding operations into a function
+    returning an operation.
+    """
+    def wrapper (*args, **kwargs):
+        op = Operation ()
+        gen = fn (*args, **kwargs)
+
+        def step (value = None, error = None):
+            try:
+                if error is not None:
+                    y = gen.throw (error)
+                else:
+                    y = gen.send (value)
+            except StopIteration:
+                op.resolve (None)
+                return
+            except Return, r:
+                op.resolve (r.value)
+                return
+            except Exception, e:
+                op.fail (e)
+                return
+            y.addCallback (lambda o: step (o.value, o.error))
+        step ()
+        return op
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def gather (operations):
+    """
+    Return an operation resolved with the list of results once every
+    operation is finished. It fails with the first error, if any.
+    """
+    operations = list (operations)
+    res = Operation ()
+    left = [len (operations)]
+
+    def finished (op):
+        left[0] -= 1
+        if left[0] == 0:
+            for o in operations:
+                if o.error is not None:
+                    res.fail (o.error)
+                    return
+            res.resolve ([o.value for o in operations])
+    if not operations:
+        res.resolve ([])
+    for op in operations:
+        op.addCallback (finished)
+    return res
+
+
+def _nonBlocking (fd):
+    flags = fcntl.fcntl (fd, fcntl.F_GETFL)
+    fcntl.fcntl (fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+
+class Reactor:
+    """
+    Event loop multiplexing subprocess outputs and timers.
+    """
+
+    logger = logging.getLogger('voodoo.reactor')
+
+    def __init__ (self):
+        self.readers = {}
+        self.timers = []
+        self.counter = itertools.count ()
+
+    def spawn (self, argv, input = None):
+        """
+        Start a process and return an operation resolved with
+        (returncode, output) when it exits.
+        """
+        p = subprocess.Popen (argv,
+                              stdin = subprocess.PIPE,
+                              stdout = subprocess.PIPE,
+                              stderr = subprocess.STDOUT,
+                              close_fds = True)
+        try:
+            if input:
+                p.stdin.write (input)
+            p.stdin.close ()
+        except IOError:
+            pass
+        op = Operation ()
+        chunks = []
+        self.watch (p, chunks.append,
+                    lambda st: op.resolve ((st, "".join (chunks))))
+        return op
+
+    def launch (self, argv, output = None):
+        """
+        Start a long-running process.
+        Its output is written to the output file object if given.
+        Return the process and an operation resolved with its exit status.
+        """
+        p = subprocess.Popen (argv,
+                              stdin = subprocess.PIPE,
+                              stdout = subprocess.PIPE,
+                              stderr = subprocess.STDOUT,
+                              close_fds = True)
+        op = Operation ()
+        if output:
+            def write (data):
+                output.write (data)
+                output.flush ()
+        else:
+            write = lambda data: None
+        self.watch (p, write, op.resolve)
+        return (p, op)
+
+    def watch (self, p, onData, onExit):
+        """
+        Feed the output of process p to onData and call onExit with its
+        status once the output is closed.
+        """
+        fd = p.stdout.fileno ()
+        _nonBlocking (fd)
+        self.readers[fd] = (p, onData, onExit)
+
+    def callLater (self, delay, fn):
+        """Call fn after delay seconds. Return a handle for cancel."""
+        timer = [time.time () + delay, self.counter.next (), fn]
+        heapq.heappush (self.timers, timer)
+        return timer
+
+    def cancel (self, timer):
+        timer[2] = None
+
+    def sleep (self, delay):
+        op = Operation ()
+        self.callLater (delay, op.resolve)
+        return op
+
+    def step (self, timeout = None):
+        """Wait for at most timeout seconds and dispatch events."""
+        now = time.time ()
+        while self.timers and self.timers[0][0] <= now:
+            (deadline, n, fn) = heapq.heappop (self.timers)
+            if fn:
+                fn ()
+        if self.timers:
+            delay = max (self.timers[0][0] - time.time (), 0.)
+            timeout = delay if timeout is None else min (timeout, delay)
+        if not self.readers:
+            if timeout:
+                time.sleep (timeout)
+            return
+        try:
+            (r, w, x) = select.select (self.readers.keys (), [], [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+        for fd in r:
+            (p, onData, onExit) = self.readers[fd]
+            try:
+                data = os.read (fd, 65536)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    continue
+                raise
+            if data:
+                onData (data)
+                continue
+            del self.readers[fd]
+            p.stdout.close ()
+            onExit (p.wait ())
+
+    def run (self, op = None, timeout = None):
+        """
+        Run the loop until op is finished (or until there is
+        nothing left to do) and return its result.
+        """
+        deadline = None if timeout is None else time.time () + timeout
+        while op is None or not op.done ():
+            if not self.readers and not self.timers:
+                if op is None:
+                    return None
+                # Nothing left can resolve op.
+                raise Exception ("operation can never complete")
+            left = None
+            if deadline is not None:
+                left = deadline - time.time ()
+                if left <= 0:
+                    raise Exception ("reactor timed out")
+            self.step (left)
+        return op.result ()
+
+
+__all__ = ["Operation", "Reactor", "Return", "coroutine", "gather"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
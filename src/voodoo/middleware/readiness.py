@@ -0,0 +1,257 @@
+"""
+This module waits for Genom modules to become ready.
+
+A module is ready once it has written its pid file
+(~/.<component>.pid-<host>).
+Locally, the home directory is watched through inotify so that
+waiting costs no system call until the file shows up.
+Remotely, a single watcher process is started per host and reports
+every pid file as soon as it appears.
+"""
+import ctypes, ctypes.util, errno, logging, os, select, struct, time
+
+from voodoo.middleware.ssh import pool as sshPool
+
+logger = logging.getLogger('voodoo.readiness')
+
+class ReadinessTimeout(Exception):
+    """
+    Raised when components are not ready before the deadline.
+
+    >>> e = ReadinessTimeout (["localhost/viam"], 1.)
+    >>> e.pending
+    ['localhost/viam']
+    >>> str (e)
+    'components not ready after 1.0s: localhost/viam'
+    """
+    def __init__ (self, pending, timeout):
+        Exception.__init__ (self, "components not ready after %ss: %s"
+                            % (timeout, ", ".join (pending)))
+        self.pending = pending
+        self.timeout = timeout
+
+
+IN_ATTRIB = 0x00000004
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+_event = struct.Struct ("iIII")
+
+class Inotify:
+    """
+    Minimal ctypes binding of the Linux inotify API.
+
+    >>> i = Inotify ()
+    >>> i.watch ("/tmp")
+    >>> i.close ()
+    """
+
+    _libc = None
+
+    def __init__ (self):
+        if Inotify._libc is None:
+            Inotify._libc = ctypes.CDLL (ctypes.util.find_library ("c"),
+                                         use_errno = True)
+        self.fd = Inotify._libc.inotify_init ()
+        if self.fd < 0:
+            e = ctypes.get_errno ()
+            raise OSError (e, os.strerror (e))
+
+    def watch (self, path, mask = IN_CREATE | IN_MOVED_TO | IN_ATTRIB):
+        if Inotify._libc.inotify_add_watch (self.fd, path, mask) < 0:
+            e = ctypes.get_errno ()
+            raise OSError (e, os.strerror (e))
+
+    def read (self, timeout):
+        """
+        Return the names reported by the next batch of events,
+        or an empty list if nothing happened before timeout.
+        """
+        try:
+            (r, w, x) = select.select ([self.fd], [], [], max (timeout, 0.))
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        if not r:
+            return []
+        buf = os.read (self.fd, 4096)
+        names = []
+        i = 0
+        while i < len (buf):
+            (wd, mask, cookie, length) = _event.unpack_from (buf, i)
+            i += _event.size
+            names.append (buf[i:i + length].rstrip ("\0"))
+            i += length
+        return names
+
+    def close (self):
+        if self.fd >= 0:
+            os.close (self.fd)
+            self.fd = -1
+
+
+def moduleName (component):
+    """
+    Strip the directory part of a component path.
+
+    >>> moduleName ("/opt/genom/bin/viam")
+    'viam'
+    """
+    return component.rsplit ('/', 1)[-1]
+
+def pidFile (component, host):
+    return os.path.join (os.getenv ("HOME"),
+                         ".%s.pid-%s" % (moduleName (component), host))
+
+
+def waitLocal (components, timeout):
+    """
+    Wait until the pid file of every component exists on this host.
+    Return the list of components which are still missing.
+
+    >>> waitLocal ([], 0.1)
+    []
+    """
+    from socket import gethostname
+    host = gethostname ()
+    pending = dict ((os.path.basename (pidFile (c, host)), c)
+                    for c in components)
+    if not pending:
+        return []
+    deadline = time.time () + timeout
+
+    try:
+        inotify = Inotify ()
+        inotify.watch (os.getenv ("HOME"))
+    except (OSError, AttributeError), e:
+        # No inotify on this system: fall back to polling.
+        logger.warning ("inotify unavailable (%s), polling pid files" % e)
+        inotify = None
+
+    try:
+        # The watch is set up before checking, so no creation is missed.
+        for name in pending.keys ():
+            if os.access (pidFile (pending[name], host), os.F_OK):
+                del pending[name]
+        while pending:
+            left = deadline - time.time ()
+            if left <= 0:
+                break
+            if inotify:
+                names = inotify.read (left)
+            else:
+                time.sleep (min (left, 0.1))
+                names = [n for n in pending.keys ()
+                         if os.access (pidFile (pending[n], host), os.F_OK)]
+            for name in names:
+                pending.pop (name, None)
+    finally:
+        if inotify:
+            inotify.close ()
+    return pending.values ()
+
+
+_watcherScript = """
+cd $HOME; h=`hostname`; pending='%s'
+while [ -n "$pending" ]; do
+  left=''
+  for c in $pending; do
+    if [ -e ".$c.pid-$h" ]; then echo $c; else left="$left $c"; fi
+  done
+  pending=$left
+  [ -n "$pending" ] || break
+  if command -v inotifywait >/dev/null 2>&1; then
+    inotifywait -qq -t 1 -e create -e moved_to . >/dev/null 2>&1
+  else
+    sleep 0.05
+  fi
+done
+"""
+
+def watcherScript (components):
+    """
+    Return a shell script printing, one per line, each component
+    whose pid file appears on the host it runs on.
+    """
+    return _watcherScript % " ".join (moduleName (c) for c in components)
+
+def startRemoteWatcher (components, host):
+    """
+    Start a single watcher on host reporting each component
+    whose pid file appears.
+    """
+    import subprocess
+    return subprocess.Popen (sshPool.command (host)
+                             + [watcherScript (components)],
+                             stdin = open (os.devnull),
+                             stdout = subprocess.PIPE)
+
+def waitReady (components, timeout):
+    """
+    Wait for several components, given as 'host/component'
+    (or 'component' for localhost).
+    Raise ReadinessTimeout listing the components which are not ready.
+
+    >>> waitReady ([], 1.)
+    """
+    byHost = {}
+    for c in components:
+        (host, sep, name) = c.partition ('/')
+        if not sep or not host:
+            (host, name) = ("localhost", c)
+        byHost.setdefault (host, []).append (moduleName (name))
+
+    deadline = time.time () + timeout
+    watchers = {}
+    try:
+        for (host, names) in byHost.iteritems ():
+            if host != "localhost":
+                watchers[host] = startRemoteWatcher (names, host)
+
+        pending = []
+        if "localhost" in byHost:
+            pending = ["localhost/" + c for c in
+                       waitLocal (byHost["localhost"],
+                                  max (deadline - time.time (), 0.))]
+
+        remaining = dict ((w.stdout.fileno (), (host, set (byHost[host])))
+                          for (host, w) in watchers.iteritems ())
+        lines = dict ((fd, "") for fd in remaining)
+        while remaining:
+            left = deadline - time.time ()
+            if left <= 0:
+                break
+            (r, w, x) = select.select (remaining.keys (), [], [], left)
+            for fd in r:
+                data = os.read (fd, 4096)
+                (host, names) = remaining[fd]
+                if not data:
+                    # Watcher exited: whatever is left will never show up.
+                    del remaining[fd]
+                    pending += [host + "/" + n for n in names]
+                    continue
+                chunks = (lines[fd] + data).split ("\n")
+                lines[fd] = chunks.pop ()
+                for name in chunks:
+                    names.discard (name)
+                if not names:
+                    del remaining[fd]
+        for (host, names) in remaining.itervalues ():
+            pending += [host + "/" + n for n in names]
+    finally:
+        for w in watchers.itervalues ():
+            if w.poll () is None:
+                w.kill ()
+            w.wait ()
+
+    if pending:
+        raise ReadinessTimeout (sorted (pending), timeout)
+
+
+__all__ = ["ReadinessTimeout", "waitReady"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
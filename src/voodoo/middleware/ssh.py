@@ -0,0 +1,220 @@
+"""
+This module keeps ssh sessions alive between remote commands.
+
+Each host gets one OpenSSH control master. Every later command to
+the same host is multiplexed over the master socket and therefore
+skips the connection and authentication handshake.
+
+Masters are evicted once idle for longer than the pool idle timeout
+(OpenSSH ControlPersist closes them on the remote side as well) and
+are health-checked before being reused after a quiet period.
+If a master cannot be established, commands transparently fall back
+to a plain ssh connection.
+"""
+import atexit, logging, os, re, shutil, subprocess, tempfile, threading, time
+
+class SshSession:
+    """
+    A control master connection to a single host.
+
+    >>> s = SshSession ("localhost", "/tmp")
+    >>> s.socket
+    '/tmp/localhost.sock'
+    >>> s.isOpen ()
+    False
+    """
+
+    def __init__ (self, host, directory, idleTimeout = 300):
+        self.host = host
+        self.socket = os.path.join (directory,
+                                    re.sub ("[^A-Za-z0-9.-]", "_", host)
+                                    + ".sock")
+        self.idleTimeout = idleTimeout
+        self.opened = None
+        self.lastUsed = None
+        self.lastChecked = None
+        self.commands = 0
+        self.lock = threading.Lock ()
+
+    def isOpen (self):
+        return self.opened is not None
+
+    def idle (self, now = None):
+        """Return how long the session has not been used (in seconds)."""
+        if self.lastUsed is None:
+            return 0.
+        return (now or time.time ()) - self.lastUsed
+
+    def open (self):
+        """
+        Start the control master.
+        ssh forks in the background once authenticated (-f),
+        so no polling on the socket is needed.
+        """
+        st = subprocess.call (["ssh", "-X", "-f", "-N", "-M",
+                               "-o", "ControlPath=%s" % self.socket,
+                               "-o", "ControlPersist=%d" % self.idleTimeout,
+                               "-o", "BatchMode=yes",
+                               self.host],
+                              stdin = open (os.devnull),
+                              stdout = open (os.devnull, 'w'),
+                              stderr = subprocess.STDOUT)
+        if st:
+            return False
+        self.opened = self.lastUsed = self.lastChecked = time.time ()
+        return True
+
+    def check (self):
+        """Ask the master whether it is still alive."""
+        st = subprocess.call (["ssh", "-o", "ControlPath=%s" % self.socket,
+                               "-O", "check", self.host],
+                              stdout = open (os.devnull, 'w'),
+                              stderr = subprocess.STDOUT)
+        self.lastChecked = time.time ()
+        return st == 0
+
+    def close (self):
+        if not self.isOpen ():
+            return
+        subprocess.call (["ssh", "-o", "ControlPath=%s" % self.socket,
+                          "-O", "exit", self.host],
+                         stdout = open (os.devnull, 'w'),
+                         stderr = subprocess.STDOUT)
+        self.opened = None
+
+    def command (self):
+        """Return the ssh command line prefix going through the master."""
+        self.lastUsed = time.time ()
+        self.commands += 1
+        return ["ssh", "-X", "-o", "ControlPath=%s" % self.socket, self.host]
+
+
+class SshPool:
+    """
+    Per-host pool of control master sessions.
+
+    >>> pool = SshPool ()
+    >>> pool.stats ()
+    {}
+    >>> pool.closeAll ()
+    """
+
+    logger = logging.getLogger('voodoo.ssh')
+
+    def __init__ (self, idleTimeout = 300, checkInterval = 30):
+        """
+        idleTimeout: close a master unused for that many seconds.
+        checkInterval: health-check a master before reuse if it has not
+        been checked for that many seconds.
+        """
+        self.idleTimeout = idleTimeout
+        self.checkInterval = checkInterval
+        self.enabled = True
+        self.directory = None
+        self.sessions = {}
+        self.handshakes = {}
+        self.fallbacks = {}
+        self.lock = threading.Lock ()
+
+    def _session (self, host):
+        if not self.directory:
+            self.directory = tempfile.mkdtemp (prefix = "voodoo-ssh-")
+        s = self.sessions.get (host, None)
+        if s is None:
+            s = SshSession (host, self.directory, self.idleTimeout)
+            self.sessions[host] = s
+        return s
+
+    def _ensure (self, s):
+        now = time.time ()
+        if s.isOpen ():
+            if s.idle (now) >= self.idleTimeout:
+                self.logger.debug ("evicting idle ssh session to %s" % s.host)
+                s.close ()
+            elif now - s.lastChecked >= self.checkInterval and not s.check ():
+                self.logger.warning ("ssh session to %s is dead, reopening"
+                                     % s.host)
+                s.opened = None
+        if s.isOpen ():
+            return True
+        self.logger.debug ("opening ssh session to %s" % s.host)
+        if not s.open ():
+            return False
+        self.handshakes[s.host] = self.handshakes.get (s.host, 0) + 1
+        return True
+
+    def command (self, host):
+        """
+        Return the ssh command line prefix to run a command on host.
+        """
+        if self.enabled:
+            self.lock.acquire ()
+            try:
+                s = self._session (host)
+            finally:
+                self.lock.release ()
+            # Hosts are opened independently so that parallel
+            # commands to different hosts do not wait for each other.
+            s.lock.acquire ()
+            try:
+                if self._ensure (s):
+                    return s.command ()
+            finally:
+                s.lock.release ()
+            self.logger.warning (
+                "failed to open ssh session to %s, fallback to plain ssh"
+                % host)
+        self.fallbacks[host] = self.fallbacks.get (host, 0) + 1
+        return ["ssh", "-X", host]
+
+    def evictIdle (self):
+        """Close every master idle for longer than the idle timeout."""
+        self.lock.acquire ()
+        try:
+            now = time.time ()
+            for s in self.sessions.itervalues ():
+                if s.isOpen () and s.idle (now) >= self.idleTimeout:
+                    s.close ()
+        finally:
+            self.lock.release ()
+
+    def closeAll (self):
+        self.lock.acquire ()
+        try:
+            for s in self.sessions.itervalues ():
+                s.close ()
+            self.sessions = {}
+            if self.directory:
+                shutil.rmtree (self.directory, True)
+                self.directory = None
+        finally:
+            self.lock.release ()
+
+    def stats (self):
+        """
+        Return per-host statistics: number of commands, handshakes
+        performed and handshakes saved by reusing the master.
+        """
+        res = {}
+        for (host, s) in self.sessions.iteritems ():
+            handshakes = self.handshakes.get (host, 0)
+            res[host] = {
+                "commands": s.commands,
+                "handshakes": handshakes,
+                "saved": s.commands - handshakes,
+                "fallbacks": self.fallbacks.get (host, 0),
+                "open": s.isOpen ()
+                }
+        return res
+
+pool = SshPool ()
+"""Pool used by voodoo.middleware.genom for all remote commands."""
+
+atexit.register (pool.closeAll)
+
+__all__ = ["SshPool", "SshSession", "pool"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
@@ -0,0 +1,235 @@
+"""
+This module keeps pre-spawned standby processes for Genom components.
+
+A Genom module registers itself in h2 under its name when it starts,
+so two live instances of the same module cannot coexist. A standby
+is therefore prepared up to that point: the ssh session, the remote
+shell and the Genom path are set up and the shell waits on its input.
+Promoting a standby only requires releasing it, which then executes
+the component in place.
+
+The pool is replenished in the background after each promotion, and
+the launch-to-ready latency of promoted and cold starts is recorded so
+that both can be compared.
+"""
+import logging, os, pipes, subprocess, threading
+
+from voodoo.middleware.ssh import pool as sshPool
+
+class StandbyPool:
+    """
+    Pre-spawned standby processes, per 'host/component'.
+
+    >>> pool = StandbyPool ()
+    >>> pool.record ("cold", 1.5)
+    >>> pool.record ("cold", 0.5)
+    >>> sorted (pool.stats ()["cold"].items ())
+    [('count', 2), ('max', 1.5), ('mean', 1.0), ('min', 0.5)]
+    >>> pool.promote ("walk") is None
+    True
+
+    Standby counts survive clear, and resume spawns the standbys again:
+
+    >>> import subprocess
+    >>> pool._spawn = lambda component, host: subprocess.Popen (
+    ...     ["cat"], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+    >>> pool.setCount ("walk", 1).join ()
+    >>> len (pool.standby["localhost/walk"])
+    1
+    >>> pool.clear ()
+    >>> (pool.counts, pool.standby)
+    ({'localhost/walk': 1}, {})
+    >>> for t in pool.resume ():
+    ...     t.join ()
+    >>> len (pool.standby["localhost/walk"])
+    1
+    >>> pool.clear ()
+    """
+
+    logger = logging.getLogger('voodoo.standby')
+
+    def __init__ (self, genomPath = lambda: os.getenv ("PATH")):
+        """
+        genomPath returns the path where the components are looked up.
+        """
+        self.genomPath = genomPath
+        self.counts = {}
+        self.standby = {}
+        self.filling = set ()
+        # Set by clear: no standby is spawned until resume.
+        self.suspended = False
+        self.latencies = {"promote": [], "cold": []}
+        self.lock = threading.Lock ()
+
+    def _spawn (self, component, host):
+        path = self.genomPath ()
+        return subprocess.Popen (sshPool.command (host) +
+                                 ["PATH=%s:$PATH; export PATH; "
+                                  "read go && exec %s"
+                                  % (pipes.quote (path), component)],
+                                 stdin = subprocess.PIPE,
+                                 stdout = subprocess.PIPE,
+                                 stderr = subprocess.STDOUT,
+                                 close_fds = True)
+
+    def setCount (self, component, count, host="localhost"):
+        """
+        Keep count standby processes for component on host.
+        Missing standbys are spawned in the background.
+        """
+        key = host + "/" + component
+        self.lock.acquire ()
+        try:
+            self.counts[key] = count
+            extra = self.standby.get (key, [])[count:]
+            self.standby[key] = self.standby.get (key, [])[:count]
+        finally:
+            self.lock.release ()
+        for p in extra:
+            self._discard (p)
+        return self.replenish (component, host)
+
+    def replenish (self, component, host="localhost"):
+        """Spawn the missing standbys of component in the background."""
+        key = host + "/" + component
+
+        def missing ():
+            if self.suspended:
+                return False
+            ps = self.standby.setdefault (key, [])
+            ps[:] = [p for p in ps if p.poll () is None]
+            return len (ps) < self.counts.get (key, 0)
+
+        def fill ():
+            p = None
+            try:
+                while True:
+                    self.lock.acquire ()
+                    try:
+                        # The pool may have been cleared or shrunk
+                        # while spawning. The last check and the end
+                        # of filling happen under the same lock, so a
+                        # concurrent replenish is not lost.
+                        if p is not None and missing ():
+                            self.standby[key].append (p)
+                            self.logger.debug ("standby %s spawned for %s"
+                                               % (p.pid, key))
+                            p = None
+                        if p is not None or not missing ():
+                            self.filling.discard (key)
+                            break
+                    finally:
+                        self.lock.release ()
+                    # Spawning may open an ssh session: do not hold the
+                    # lock meanwhile, promotions must not wait for it.
+                    p = self._spawn (component, host)
+            except:
+                self.lock.acquire ()
+                try:
+                    self.filling.discard (key)
+                finally:
+                    self.lock.release ()
+                raise
+            if p is not None:
+                self._discard (p)
+
+        self.lock.acquire ()
+        try:
+            if key in self.filling:
+                return None
+            self.filling.add (key)
+        finally:
+            self.lock.release ()
+        t = threading.Thread (target = fill)
+        t.daemon = True
+        t.start ()
+        return t
+
+    def promote (self, component, host="localhost"):
+        """
+        Release a standby of component and return its process,
+        or None if there is no live standby.
+        """
+        key = host + "/" + component
+        p = None
+        self.lock.acquire ()
+        try:
+            ps = self.standby.get (key, [])
+            while ps and p is None:
+                p = ps.pop (0)
+                if p.poll () is not None:
+                    p = None
+        finally:
+            self.lock.release ()
+        if p is None:
+            return None
+        try:
+            p.stdin.write ("go\n")
+            p.stdin.flush ()
+        except IOError:
+            return None
+        if self.counts.get (key, 0):
+            self.replenish (component, host)
+        return p
+
+    def _discard (self, p):
+        if p.poll () is None:
+            p.stdin.close ()
+            p.wait ()
+
+    def clear (self):
+        """
+        Discard every standby process and spawn no more until resume.
+        The standby counts are kept.
+        """
+        self.lock.acquire ()
+        try:
+            (standby, self.standby) = (self.standby, {})
+            self.suspended = True
+        finally:
+            self.lock.release ()
+        for ps in standby.itervalues ():
+            for p in ps:
+                self._discard (p)
+
+    def resume (self):
+        """
+        Spawn again the standbys of every count set, after clear.
+        Return the filling threads (see replenish).
+        """
+        self.lock.acquire ()
+        try:
+            self.suspended = False
+            keys = [k for (k, c) in self.counts.iteritems () if c]
+        finally:
+            self.lock.release ()
+        threads = []
+        for key in keys:
+            (host, component) = key.split ("/", 1)
+            threads.append (self.replenish (component, host))
+        return threads
+
+    def record (self, kind, latency):
+        """Record a launch-to-ready latency ('promote' or 'cold')."""
+        self.latencies[kind].append (latency)
+
+    def stats (self):
+        """Return latency statistics of promoted and cold starts."""
+        res = {}
+        for (kind, values) in self.latencies.iteritems ():
+            if values:
+                res[kind] = {"count": len (values),
+                             "min": min (values),
+                             "max": max (values),
+                             "mean": sum (values) / len (values)}
+            else:
+                res[kind] = {"count": 0}
+        return res
+
+
+__all__ = ["StandbyPool"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
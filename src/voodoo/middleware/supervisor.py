@@ -0,0 +1,250 @@
+"""
+This module supervises Genom component processes.
+
+Exits are detected as they happen: locally started processes are
+checked when SIGCHLD is delivered (through the signal wakeup file
+descriptor, so that nothing is polled), and components started by a
+batch script are reported by the script itself, which acts as the
+single watcher of its host.
+
+Crashed components are restarted with an exponential backoff and
+every lifecycle transition is published as an event.
+"""
+import Queue, errno, fcntl, logging, os, select, signal, threading, time
+
+STARTED = "started"
+EXITED = "exited"
+CRASHED = "crashed"
+RESTARTING = "restarting"
+STOPPED = "stopped"
+GAVE_UP = "gave-up"
+
+class Event:
+    """
+    A lifecycle transition of a component.
+
+    >>> Event ("localhost/viam", CRASHED, 1, 0.)
+    <Event localhost/viam crashed (1) at 0.000>
+    """
+    def __init__ (self, key, state, detail = None, timestamp = None):
+        self.key = key
+        self.state = state
+        self.detail = detail
+        self.timestamp = time.time () if timestamp is None else timestamp
+
+    def __repr__ (self):
+        return "<Event %s %s (%s) at %.3f>" % (self.key, self.state,
+                                               self.detail, self.timestamp)
+
+
+class Supervisor:
+    """
+    Watch component processes and restart the ones which crash.
+
+    restart is called with (component, host) to start a component
+    again. The restart delay doubles after each crash, from backoff to
+    maxBackoff, and is reset once a component stayed up for stableTime.
+    After maxRestarts consecutive crashes, the component is given up.
+
+    >>> import subprocess
+    >>> s = Supervisor ()
+    >>> s.start ()
+    >>> events = s.subscribe ()
+    >>> s.watch ("localhost/false", subprocess.Popen (["false"]))
+    >>> events.get (timeout = 5.).state
+    'started'
+    >>> events.get (timeout = 5.)                    #doctest: +ELLIPSIS
+    <Event localhost/false crashed (1) at ...>
+    >>> s.stop ()
+    """
+
+    logger = logging.getLogger('voodoo.supervisor')
+
+    def __init__ (self, restart = None, backoff = 0.5, maxBackoff = 30.,
+                  stableTime = 60., maxRestarts = 10):
+        self.restart = restart
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.stableTime = stableTime
+        self.maxRestarts = maxRestarts
+        self.processes = {}
+        self.since = {}
+        self.crashes = {}
+        self.expected = set ()
+        self.subscribers = []
+        self.lock = threading.Lock ()
+        self.thread = None
+        self.running = False
+        (self.wakeup, self.wakeupWrite) = os.pipe ()
+        for fd in (self.wakeup, self.wakeupWrite):
+            flags = fcntl.fcntl (fd, fcntl.F_GETFL)
+            fcntl.fcntl (fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.sigchld = False
+
+    def start (self):
+        """
+        Start the supervision thread. SIGCHLD can only be hooked from
+        the main thread: elsewhere, a thread waits on each process.
+        """
+        if self.running:
+            return
+        self.running = True
+        if threading.currentThread ().name == "MainThread":
+            signal.signal (signal.SIGCHLD, lambda signum, frame: None)
+            # Do not interrupt system calls of the rest of the program.
+            signal.siginterrupt (signal.SIGCHLD, False)
+            signal.set_wakeup_fd (self.wakeupWrite)
+            self.sigchld = True
+        self.thread = threading.Thread (target = self._run)
+        self.thread.daemon = True
+        self.thread.start ()
+
+    def stop (self):
+        self.running = False
+        self._wake ()
+        if self.thread:
+            self.thread.join ()
+            self.thread = None
+        if self.sigchld:
+            signal.set_wakeup_fd (-1)
+            signal.signal (signal.SIGCHLD, signal.SIG_DFL)
+            self.sigchld = False
+
+    def _wake (self):
+        try:
+            os.write (self.wakeupWrite, "x")
+        except OSError:
+            pass
+
+    def subscribe (self, callback = None):
+        """
+        Subscribe to lifecycle events. callback is called with each
+        event; without callback, a Queue receiving the events is
+        returned.
+        """
+        if callback is None:
+            q = Queue.Queue ()
+            callback = q.put
+        else:
+            q = None
+        self.subscribers.append (callback)
+        return q
+
+    def publish (self, event):
+        self.logger.debug ("%s" % event)
+        for callback in self.subscribers:
+            try:
+                callback (event)
+            except Exception, e:
+                self.logger.warning ("event subscriber failed: %s" % e)
+
+    def watch (self, key, process = None):
+        """
+        Supervise component key ('host/component'). process is the local
+        process to watch; without it, the exit has to be reported by
+        calling exited.
+        """
+        self.lock.acquire ()
+        try:
+            self.expected.discard (key)
+            self.since[key] = time.time ()
+            if process is not None:
+                self.processes[key] = process
+        finally:
+            self.lock.release ()
+        self.publish (Event (key, STARTED))
+        if process is not None:
+            if not self.sigchld:
+                t = threading.Thread (target = self._waitFor,
+                                      args = (key, process))
+                t.daemon = True
+                t.start ()
+            else:
+                # The process may have exited before being watched.
+                self._wake ()
+
+    def expect (self, key):
+        """Announce an intentional stop: the exit is not a crash."""
+        self.lock.acquire ()
+        try:
+            self.expected.add (key)
+        finally:
+            self.lock.release ()
+
+    def _waitFor (self, key, process):
+        self.exited (key, process.wait (), process)
+
+    def exited (self, key, status, process = None):
+        """Handle the exit of component key with status."""
+        self.lock.acquire ()
+        try:
+            if process is not None and self.processes.get (key) is not process:
+                return
+            self.processes.pop (key, None)
+            expected = key in self.expected
+            self.expected.discard (key)
+            uptime = time.time () - self.since.pop (key, time.time ())
+        finally:
+            self.lock.release ()
+
+        if expected:
+            self.publish (Event (key, STOPPED, status))
+            return
+        if status == 0:
+            self.publish (Event (key, EXITED, status))
+            return
+        self.publish (Event (key, CRASHED, status))
+        if uptime >= self.stableTime:
+            self.crashes[key] = 0
+        n = self.crashes.get (key, 0)
+        if not self.restart or not self.running:
+            return
+        if self.maxRestarts is not None and n >= self.maxRestarts:
+            self.publish (Event (key, GAVE_UP, n))
+            return
+        self.crashes[key] = n + 1
+        delay = min (self.backoff * 2 ** n, self.maxBackoff)
+        self.publish (Event (key, RESTARTING, delay))
+        t = threading.Timer (delay, self._restart, (key,))
+        t.daemon = True
+        t.start ()
+
+    def _restart (self, key):
+        if not self.running or key in self.expected:
+            return
+        (host, component) = key.split ('/', 1)
+        try:
+            self.restart (component, host)
+        except Exception, e:
+            self.logger.warning ("failed to restart %s: %s" % (key, e))
+            self.exited (key, -1)
+
+    def _run (self):
+        while self.running:
+            try:
+                select.select ([self.wakeup], [], [])
+            except select.error, e:
+                if e.args[0] != errno.EINTR:
+                    raise
+            try:
+                os.read (self.wakeup, 4096)
+            except OSError:
+                pass
+            self.lock.acquire ()
+            try:
+                processes = self.processes.items ()
+            finally:
+                self.lock.release ()
+            for (key, p) in processes:
+                status = p.poll ()
+                if status is not None:
+                    self.exited (key, status, p)
+
+
+__all__ = ["Event", "Supervisor",
+           "STARTED", "EXITED", "CRASHED", "RESTARTING", "STOPPED", "GAVE_UP"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
@@ -0,0 +1,119 @@
+"""
+This module tears Genom down in bounded time.
+
+Each host receives a single script which scans /proc once, sends
+SIGTERM to every matching process at once, sends SIGKILL to the
+survivors after a deadline, removes the pid files left behind and
+ends h2. Hosts are handled in parallel, so shutdown takes about one
+deadline whatever the number of components and hosts.
+"""
+import logging, pipes, subprocess
+
+from voodoo.middleware.ssh import pool as sshPool
+from voodoo.util.parallel import parallel_map
+
+logger = logging.getLogger('voodoo.teardown')
+
+_script = """
+PATH=%(path)s:$PATH; export PATH
+names=' %(names)s '; h=`hostname`; pids=''
+for d in /proc/[0-9]*; do
+  read c < $d/comm 2>/dev/null || continue
+  case "$names" in *" $c "*) pids="$pids ${d#/proc/}";; esac
+done
+set -- $pids; echo signalled $#
+[ -n "$pids" ] && kill -TERM $pids 2>/dev/null
+i=0
+while [ -n "$pids" ] && [ $i -lt %(ticks)d ]; do
+  alive=''
+  for p in $pids; do kill -0 $p 2>/dev/null && alive="$alive $p"; done
+  pids=$alive
+  [ -n "$pids" ] && sleep 0.05
+  i=$((i+1))
+done
+set -- $pids; echo killed $#
+[ -n "$pids" ] && kill -KILL $pids 2>/dev/null
+for c in %(modules)s; do rm -f "$HOME/.$c.pid-$h"; done
+%(h2)s
+"""
+
+_h2 = """%s info >/dev/null 2>&1
+if [ $? -eq 3 ]; then echo h2 none
+elif %s end >/dev/null 2>&1; then echo h2 ended
+else echo h2 failed; fi"""
+
+def teardownScript (names, path, deadline = 2., h2 = "h2"):
+    """
+    Generate the teardown script killing the processes named names.
+    If h2 is not None, it is the h2 command used to end h2.
+
+    >>> s = teardownScript (["tclserv", "/opt/bin/viam"], "/usr/bin", 1.)
+    >>> "names=' tclserv viam '" in s
+    True
+    >>> "h2 end" in s
+    True
+    """
+    # /proc/<pid>/comm is truncated to 15 characters.
+    names = [n.rsplit ('/', 1)[-1] for n in names]
+    return _script % {
+        "path": pipes.quote (path),
+        "names": " ".join (n[:15] for n in names),
+        "modules": " ".join (names) or ":",
+        "ticks": max (int (deadline / 0.05), 1),
+        "h2": h2 and _h2 % (h2, h2) or ""
+        }
+
+def parseReport (output):
+    """
+    Parse the output of a teardown script.
+
+    >>> sorted (parseReport ("signalled 3\\nkilled 1\\nh2 ended\\n").items ())
+    [('h2', 'ended'), ('killed', 1), ('signalled', 3)]
+    """
+    res = {}
+    for line in output.splitlines ():
+        words = line.split ()
+        if len (words) != 2:
+            continue
+        if words[0] in ("signalled", "killed"):
+            res[words[0]] = int (words[1])
+        elif words[0] == "h2":
+            res["h2"] = words[1]
+    return res
+
+def teardownHost (host, names, path, deadline = 2., h2 = "h2"):
+    """
+    Kill the processes named names on host and end h2.
+    Return the report of the host (see parseReport).
+    """
+    p = subprocess.Popen (sshPool.command (host) + ["sh -s"],
+                          stdin = subprocess.PIPE,
+                          stdout = subprocess.PIPE,
+                          stderr = subprocess.STDOUT)
+    (out, err) = p.communicate (teardownScript (names, path, deadline, h2))
+    report = parseReport (out)
+    logger.debug ("teardown of %s: %s" % (host, report))
+    if p.returncode or "killed" not in report:
+        raise Exception ("teardown of %s failed (status = %d): %s"
+                         % (host, p.returncode, out.strip ()))
+    if report.get ("h2") == "failed":
+        raise Exception ("Failed to terminate h2 on %s" % host)
+    return report
+
+def teardown (hosts, path, deadline = 2., h2 = "h2"):
+    """
+    Tear several hosts down in parallel. hosts maps each host to the
+    names of the processes to kill there.
+    Return the reports and the errors of the hosts.
+    """
+    return parallel_map (lambda host: teardownHost (host, hosts[host], path,
+                                                    deadline, h2),
+                         hosts.keys ())
+
+
+__all__ = ["teardown", "teardownHost", "teardownScript"]
+
+if __name__ == "__main__":
+    import doctest
+    logging.basicConfig (level=logging.DEBUG)
+    doctest.testmod (verbose = True)
@@ -0,0 +1,210 @@
+"""
+Movement plans: timelines of keyframes held in numpy arrays.
+"""
+import numpy
+
+class MovementPlan:
+    """
+    Define a movement plan: a timeline of keyframes, each made of a
+    time and a state vector.
+
+    Keyframes are stored in contiguous arrays, a time column and a
+    state matrix, grown by doubling on append. Times are
+    non-decreasing, so lookups are binary searches and interpolation
+    over any vector of query times is a single vectorized call.
+
+    >>> plan = MovementPlan([(0., [0., 0.]), (1., [1., 10.])])
+    >>> plan.append(2., [0., 20.])
+    >>> len(plan)
+    3
+    >>> plan.interpolate([0.5, 1.5]).tolist()
+    [[0.5, 5.0], [0.5, 15.0]]
+    >>> plan.resample(4.).times.tolist()
+    [0.0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0]
+    >>> plan.between(0.5, 2.).times.tolist()
+    [1.0]
+    >>> plan.index(1.2)
+    1
+    >>> plan.timeline.append((3., [0., 0.]))
+    Traceback (most recent call last):
+    AttributeError: 'tuple' object has no attribute 'append'
+    """
+    def __init__(self, timeline = None, times = None, states = None,
+                 check = True):
+        """
+        Build a plan from a timeline, a sequence of (time, state)
+        pairs, or from an array of times and a matrix of states (one
+        row per keyframe), which are used without copy. check
+        controls whether times are checked to be sorted.
+        """
+        if timeline is not None:
+            timeline = list(timeline)
+            times = [t for (t, s) in timeline]
+            states = [s for (t, s) in timeline]
+        self._times = numpy.asarray(times if times is not None else [],
+                                    numpy.float64)
+        states = numpy.asarray(states if states is not None else [],
+                               numpy.float64)
+        if not states.size:
+            states = states.reshape(len(self._times), 0)
+        elif states.ndim == 1:
+            states = states.reshape(len(self._times), -1)
+        if len(states) != len(self._times):
+            raise ValueError("%d times for %d states"
+                             % (len(self._times), len(states)))
+        if check and len(self._times) and \
+                (numpy.diff(self._times) < 0).any():
+            raise ValueError("times are not sorted")
+        self._states = states
+        self.size = len(self._times)
+
+    @property
+    def times(self):
+        return self._times[:self.size]
+
+    @property
+    def states(self):
+        return self._states[:self.size]
+
+    @property
+    def dimension(self):
+        return self._states.shape[1]
+
+    @property
+    def timeline(self):
+        """
+        The keyframes as a tuple of (time, state) pairs. Keyframes are
+        added with append or extend.
+        """
+        return tuple(zip(self.times.tolist(), self.states))
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        """
+        Return the (time, state) keyframe at an index, or the plan made
+        of a slice of keyframes, sharing the memory of this one.
+        """
+        if isinstance(key, slice):
+            return MovementPlan(times = self.times[key],
+                                states = self.states[key])
+        return (float(self.times[key]), self.states[key])
+
+    @property
+    def start(self):
+        return float(self._times[0])
+
+    @property
+    def end(self):
+        return float(self._times[self.size - 1])
+
+    @property
+    def duration(self):
+        return self.size and self.end - self.start or 0.
+
+    def _reserve(self, size, dimension):
+        if self.size and dimension != self.dimension:
+            raise ValueError("states have %d values, not %d"
+                             % (self.dimension, dimension))
+        capacity = len(self._times)
+        writable = self._times.flags.writeable and self._times.flags.owndata
+        if size <= capacity and writable:
+            return
+        capacity = max(size, 2 * capacity, 16)
+        times = numpy.empty(capacity, numpy.float64)
+        states = numpy.empty((capacity, dimension), numpy.float64)
+        if self.size:
+            times[:self.size] = self.times
+            states[:self.size] = self.states
+        (self._times, self._states) = (times, states)
+
+    def append(self, time, state):
+        """Append a keyframe, at or after the last one."""
+        state = numpy.asarray(state, numpy.float64).ravel()
+        if self.size and time < self._times[self.size - 1]:
+            raise ValueError("keyframe at %g precedes the end of the plan"
+                             % time)
+        self._reserve(self.size + 1, len(state))
+        self._times[self.size] = time
+        self._states[self.size] = state
+        self.size += 1
+
+    def extend(self, times, states):
+        """Append keyframes given as an array of times and of states."""
+        times = numpy.asarray(times, numpy.float64)
+        states = numpy.asarray(states, numpy.float64).reshape(len(times), -1)
+        if not len(times):
+            return
+        if (numpy.diff(times) < 0).any() or \
+                (self.size and times[0] < self._times[self.size - 1]):
+            raise ValueError("keyframes are not sorted")
+        self._reserve(self.size + len(times), states.shape[1])
+        self._times[self.size:self.size + len(times)] = times
+        self._states[self.size:self.size + len(times)] = states
+        self.size += len(times)
+
+    def index(self, time):
+        """
+        Return the index of the last keyframe at or before time
+        (-1 if time precedes the plan). Times may be an array.
+        """
+        return numpy.searchsorted(self.times, time, 'right') - 1
+
+    def interpolate(self, times):
+        """
+        Return the states at times (a scalar or an array), linearly
+        interpolated between keyframes and held constant outside.
+        """
+        if not self.size:
+            raise ValueError("empty plan")
+        times = numpy.asarray(times, numpy.float64)
+        plan_times = self.times
+        states = self.states
+        i = numpy.clip(numpy.searchsorted(plan_times, times, 'right') - 1,
+                       0, max(self.size - 2, 0))
+        j = numpy.minimum(i + 1, self.size - 1)
+        span = plan_times[j] - plan_times[i]
+        with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+            w = numpy.where(span > 0, (times - plan_times[i]) / span, 0.)
+        w = numpy.clip(w, 0., 1.)[..., numpy.newaxis]
+        return states[i] * (1. - w) + states[j] * w
+
+    def resample(self, rate, start = None, end = None):
+        """Return the plan interpolated at a fixed rate (Hz)."""
+        start = self.start if start is None else start
+        end = self.end if end is None else end
+        n = int(numpy.floor((end - start) * rate + 1e-9)) + 1
+        times = start + numpy.arange(n) / float(rate)
+        return MovementPlan(times = times, states = self.interpolate(times))
+
+    def between(self, start, end):
+        """Return the keyframes in [start, end), sharing memory."""
+        (i, j) = numpy.searchsorted(self.times, [start, end], 'left')
+        return self[i:j]
+
+    def save(self, path):
+        """Save the plan in a binary file (see voodoo.plan_file)."""
+        # Imported here: voodoo.plan_file imports this module.
+        import voodoo.plan_file
+        voodoo.plan_file.save(self, path)
+
+    @staticmethod
+    def open(path):
+        """Open a plan saved by save, memory-mapped."""
+        import voodoo.plan_file
+        return voodoo.plan_file.open_plan(path)
+
+    def memory(self):
+        """Report the memory used and allocated by the plan, in bytes."""
+        used = self.times.nbytes + self.states.nbytes
+        allocated = self._times.nbytes + self._states.nbytes
+        return {'keyframes': self.size, 'dimension': self.dimension,
+                'used': used, 'allocated': allocated,
+                'per_keyframe': self._states.itemsize * (self.dimension + 1)}
+
+__all__ = ["MovementPlan"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
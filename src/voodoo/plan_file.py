@@ -0,0 +1,126 @@
+"""
+Binary, memory-mapped files of movement plans.
+
+A plan file is made of a header, the time index (one float64 per
+keyframe) and the state block (one row of float64 per keyframe), both
+aligned on pages. Opening a plan maps the file without reading it:
+pages are read when keyframes are first accessed, so a plan can be
+streamed from its first keyframe right away, and a time lookup only
+touches the pages of the time index it visits.
+
+>>> import os, tempfile
+>>> path = tempfile.mktemp()
+>>> save(MovementPlan([(0., [1., 2.]), (0.5, [3., 4.])]), path)
+>>> plan = open_plan(path)
+>>> (len(plan), plan.dimension, plan.interpolate(0.25).tolist())
+(2, 2, [2.0, 3.0])
+>>> os.remove(path)
+"""
+import os, time, unittest
+
+import numpy
+
+from voodoo.plan import MovementPlan
+
+MAGIC = 'VDPLAN01'
+VERSION = 1
+
+HEADER = numpy.dtype([('magic', 'S8'), ('version', '<u4'),
+                      ('dimension', '<u4'), ('count', '<u8'),
+                      ('times_offset', '<u8'), ('states_offset', '<u8'),
+                      ('start', '<f8'), ('end', '<f8'),
+                      ('reserved', '<u8', (4,))])
+
+ALIGNMENT = 4096
+
+def _align(n):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+def save(plan, path):
+    """Write plan to path. The file is renamed into place once complete."""
+    count = len(plan)
+    times_offset = _align(HEADER.itemsize)
+    states_offset = _align(times_offset + 8 * count)
+    header = numpy.zeros(1, HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['dimension'] = plan.dimension
+    header['count'] = count
+    header['times_offset'] = times_offset
+    header['states_offset'] = states_offset
+    if count:
+        (header['start'], header['end']) = (plan.start, plan.end)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    f = open(tmp, 'wb')
+    try:
+        f.write(header.tostring())
+        f.seek(times_offset)
+        f.write(numpy.ascontiguousarray(plan.times, '<f8').tostring())
+        f.seek(states_offset)
+        f.write(numpy.ascontiguousarray(plan.states, '<f8').tostring())
+        f.truncate(states_offset + 8 * plan.dimension * count)
+    finally:
+        f.close()
+    os.rename(tmp, path)
+
+def open_plan(path):
+    """
+    Return the plan saved at path, memory-mapped read-only. Appending
+    to it copies it to memory first.
+    """
+    header = numpy.fromfile(path, HEADER, 1)
+    if not len(header) or header['magic'][0] != MAGIC:
+        raise ValueError("%s is not a movement plan" % path)
+    header = header[0]
+    if header['version'] != VERSION:
+        raise ValueError("unsupported movement plan version %d"
+                         % header['version'])
+    (count, dimension) = (int(header['count']), int(header['dimension']))
+    if not count:
+        return MovementPlan(times = numpy.zeros(0),
+                            states = numpy.zeros((0, dimension)))
+    times = numpy.memmap(path, '<f8', 'r', int(header['times_offset']),
+                         (count,))
+    states = numpy.memmap(path, '<f8', 'r', int(header['states_offset']),
+                          (count, dimension))
+    return MovementPlan(times = times, states = states, check = False)
+
+
+class planFileTest(unittest.TestCase):
+    """Round trip and save/load time of a large plan."""
+
+    keyframes = 500000
+    dimension = 30
+
+    def test(self):
+        import tempfile
+        times = numpy.arange(self.keyframes) * 0.005
+        states = numpy.random.rand(self.keyframes, self.dimension)
+        plan = MovementPlan(times = times, states = states)
+        path = tempfile.mktemp()
+        try:
+            t = time.time()
+            save(plan, path)
+            saved = time.time() - t
+            t = time.time()
+            loaded = open_plan(path)
+            first = loaded[0]
+            opened = time.time() - t
+            t = time.time()
+            self.assertTrue((loaded.times == times).all())
+            self.assertTrue((loaded.states == states).all())
+            read = time.time() - t
+            self.assertEqual(first[0], 0.)
+            print "%d keyframes (%d MB): save %.3fs, open and first " \
+                "keyframe %.6fs, full read %.3fs" \
+                % (self.keyframes, os.path.getsize(path) >> 20,
+                   saved, opened, read)
+        finally:
+            os.remove(path)
+
+__all__ = ["open_plan", "save"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+    unittest.main()
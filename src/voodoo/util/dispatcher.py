@@ -0,0 +1,217 @@
+import collections, logging, sys, threading, time
+
+from voodoo.util.histogram import Histogram
+
+class CancelledError(Exception):
+    """Raised when the result of a cancelled request is requested."""
+    pass
+
+class TimeoutError(Exception):
+    """
+    Raised when a result is not available in time, or when a request
+    did not start before its deadline.
+    """
+    pass
+
+PENDING, RUNNING, FINISHED, CANCELLED = \
+    ('pending', 'running', 'finished', 'cancelled')
+
+class Future(object):
+    """Result of a request submitted to a Dispatcher."""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = PENDING
+        self.condition = threading.Condition()
+        self.value = None
+        self.error = None
+        self.callbacks = []
+
+    def __repr__(self):
+        return "<Future %s %s>" % (self.name, self.state)
+
+    def cancel(self):
+        """Cancel the request if it did not start. Return whether it did."""
+        with self.condition:
+            if self.state == CANCELLED:
+                return True
+            if self.state != PENDING:
+                return False
+            self.state = CANCELLED
+            self.condition.notifyAll()
+        self._callback()
+        return True
+
+    def cancelled(self):
+        return self.state == CANCELLED
+
+    def running(self):
+        return self.state == RUNNING
+
+    def done(self):
+        return self.state in (FINISHED, CANCELLED)
+
+    def _wait(self, timeout):
+        with self.condition:
+            if not self.done():
+                self.condition.wait(timeout)
+            if self.state == CANCELLED:
+                raise CancelledError(self.name)
+            if self.state != FINISHED:
+                raise TimeoutError("%s did not complete in %ss"
+                                   % (self.name, timeout))
+
+    def result(self, timeout=None):
+        """
+        Wait for the result for at most timeout seconds, and return it
+        or raise the exception of the request.
+        """
+        self._wait(timeout)
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+        return self.value
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self.error and self.error[1]
+
+    def add_done_callback(self, callback):
+        """Call callback with the future once it is done."""
+        with self.condition:
+            if not self.done():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def _start(self):
+        with self.condition:
+            if self.state != PENDING:
+                return False
+            self.state = RUNNING
+            return True
+
+    def _finish(self, value=None, error=None):
+        with self.condition:
+            (self.value, self.error) = (value, error)
+            self.state = FINISHED
+            self.condition.notifyAll()
+        self._callback()
+
+    def _callback(self):
+        for callback in self.callbacks:
+            try:
+                callback(self)
+            except Exception, e:
+                logging.getLogger('voodoo.dispatcher') \
+                    .warning("future callback failed: %s" % e)
+
+
+class Dispatcher(object):
+    """
+    Run the requests of a component in submission order, in a thread
+    of its own, so that requests to different components overlap.
+    The latency (from submission to completion) of each kind of
+    request is recorded in a histogram.
+
+    >>> d = Dispatcher('test')
+    >>> f = d.submit(lambda x: x * 2, 21)
+    >>> f.result(timeout=5.)
+    42
+    >>> blocker = threading.Event()
+    >>> slow = d.submit(blocker.wait)
+    >>> queued = d.submit(lambda: 1)
+    >>> queued.cancel()
+    True
+    >>> slow.result(timeout=0.01)
+    Traceback (most recent call last):
+    ...
+    TimeoutError: wait did not complete in 0.01s
+    >>> blocker.set()
+    >>> queued.result()
+    Traceback (most recent call last):
+    ...
+    CancelledError: <lambda>
+    >>> d.stop()
+    >>> sorted(d.latency.keys())
+    ['<lambda>', 'wait']
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = logging.getLogger('voodoo.dispatcher')
+        self.queue = collections.deque()
+        self.condition = threading.Condition()
+        self.latency = collections.defaultdict(Histogram)
+        self.running = True
+        self.thread = threading.Thread(target=self._run,
+                                       name="dispatcher-%s" % name)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue the call fn(*args, **kwargs) and return its Future.
+        The keyword argument deadline (seconds) cancels the request
+        with a TimeoutError if it did not start in time; name names
+        the request in the latency histograms (fn.__name__ by default).
+        """
+        deadline = kwargs.pop('deadline', None)
+        name = kwargs.pop('name', None) or getattr(fn, '__name__', repr(fn))
+        future = Future(name)
+        now = time.time()
+        with self.condition:
+            if not self.running:
+                raise Exception("dispatcher %s is stopped" % self.name)
+            self.queue.append((future, fn, args, kwargs, now,
+                               deadline and now + deadline))
+            self.condition.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                (future, fn, args, kwargs, submitted, deadline) = \
+                    self.queue.popleft()
+            if not future._start():
+                continue
+            if deadline is not None and time.time() > deadline:
+                future._finish(error=(TimeoutError, TimeoutError(
+                    "%s did not start before its deadline" % future.name),
+                                      None))
+                continue
+            (value, error) = (None, None)
+            try:
+                value = fn(*args, **kwargs)
+            except Exception:
+                error = sys.exc_info()
+            self.latency[future.name].record(time.time() - submitted)
+            future._finish(value, error)
+
+    def pending(self):
+        with self.condition:
+            return len(self.queue)
+
+    def stop(self, cancel=True):
+        """
+        Stop the dispatcher once the running request is done. Queued
+        requests are cancelled, or run first if cancel is False.
+        """
+        with self.condition:
+            self.running = False
+            if cancel:
+                while self.queue:
+                    self.queue.popleft()[0].cancel()
+            self.condition.notify()
+        if threading.currentThread() is not self.thread:
+            self.thread.join()
+
+    def stats(self):
+        """Return the latency summary of each kind of request."""
+        return dict((name, h.summary())
+                    for (name, h) in self.latency.items())
+
+__all__ = ["CancelledError", "Dispatcher", "Future", "TimeoutError"]
@@ -0,0 +1,85 @@
+import bisect, math
+
+class Histogram(object):
+    """
+    Histogram of durations (seconds) in logarithmic buckets: recording
+    a value is cheap and percentiles are exact to within a bucket
+    (about 9% with the default of 8 buckets per octave).
+
+    >>> h = Histogram()
+    >>> for ms in range(1, 101):
+    ...     h.record(ms / 1000.)
+    >>> (h.count, round(h.mean, 4), h.max)
+    (100, 0.0505, 0.1)
+    >>> 0.050 <= h.percentile(50) < 0.055
+    True
+    >>> 0.099 <= h.percentile(99) <= 0.1
+    True
+    """
+
+    def __init__(self, minimum=1e-6, maximum=100., per_octave=8):
+        n = int(math.ceil(math.log(maximum / minimum, 2) * per_octave))
+        # Upper bounds of the buckets; the last bucket is unbounded.
+        self.bounds = [minimum * 2 ** (float(i) / per_octave)
+                       for i in range(n + 1)]
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.count and self.total / self.count or 0.
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket holding percentile p."""
+        if not self.count:
+            return 0.
+        rank = p / 100. * self.count
+        seen = 0
+        for (i, n) in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                if i >= len(self.bounds):
+                    return self.max
+                # The bucket bound may exceed every recorded value.
+                return min(self.bounds[i], self.max)
+        return self.max
+
+    def merge(self, other):
+        """Add the values recorded by other, which has the same buckets."""
+        if other.bounds != self.bounds:
+            raise ValueError("histograms have different buckets")
+        for (i, n) in enumerate(other.counts):
+            self.counts[i] += n
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = min(self.min, value) \
+                    if self.min is not None else value
+                self.max = max(self.max, value)
+
+    def summary(self):
+        """Return the count, mean, extrema and usual percentiles."""
+        return {'count': self.count, 'mean': self.mean,
+                'min': self.min or 0., 'max': self.max or 0.,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+    def __repr__(self):
+        s = self.summary()
+        return "<Histogram n=%d mean=%.3gs p50=%.3gs p99=%.3gs max=%.3gs>" \
+            % (s['count'], s['mean'], s['p50'], s['p99'], s['max'])
+
+__all__ = ["Histogram"]
@@ -0,0 +1,176 @@
+import collections, threading, unittest
+
+class LRUCache(object):
+    """
+    Mapping keeping at most maxsize entries, evicting the least
+    recently used one.
+
+    >>> c = LRUCache(2)
+    >>> c['a'] = 1
+    >>> c['b'] = 2
+    >>> c['a']
+    1
+    >>> c['c'] = 3
+    >>> sorted(c.keys())
+    ['a', 'c']
+    >>> c.get_or_create('b', int, '4')
+    4
+    >>> sorted(c.stats().items())
+    [('evictions', 2), ('hits', 0), ('misses', 1), ('size', 2)]
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        # Entries in order of use, the least recently used first: a
+        # hit moves its entry to the end, eviction pops the first one.
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def keys(self):
+        return self.entries.keys()
+
+    def __getitem__(self, key):
+        with self.lock:
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key in self.entries:
+                del self.entries[key]
+            elif len(self.entries) >= self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            self.entries[key] = value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.entries.pop(key, default)
+
+    def get_or_create(self, key, create, *args):
+        """
+        Return the value of key, calling create(*args) to make it if
+        missing.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                return value
+            self.misses += 1
+        value = create(*args)
+        self[key] = value
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self.entries)}
+
+
+class RequestTemplates(object):
+    """
+    Reusable, pre-filled request structures. A template is created
+    once per key and its variable fields are only written when their
+    values change. Each thread has templates of its own, at most
+    maxsize of them, so that a template is never refilled by another
+    thread between its fill and its use.
+
+    >>> class Request:
+    ...     def __init__(self, bank): self.bank = bank
+    >>> def fill(request, n): request.n = n
+    >>> t = RequestTemplates()
+    >>> r = t.request('acquire', ('b',), Request, (1,), fill)
+    >>> r is t.request('acquire', ('b',), Request, (1,), fill)
+    True
+    >>> t.request('acquire', ('b',), Request, (5,), fill).n
+    5
+    >>> other = []
+    >>> th = threading.Thread(target=lambda: other.append(
+    ...     t.request('acquire', ('b',), Request, (1,), fill)))
+    >>> th.start(); th.join()
+    >>> (other[0] is r, r.n)
+    (False, 5)
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.local = threading.local()
+
+    def cache(self):
+        """Return the templates of the calling thread."""
+        try:
+            return self.local.cache
+        except AttributeError:
+            self.local.cache = LRUCache(self.maxsize)
+            return self.local.cache
+
+    def request(self, kind, key, create, values, fill):
+        """
+        Return the template of kind for key (a tuple), made by
+        create(*key), with the fields set by fill(template, *values)
+        up to date. The template belongs to the calling thread and
+        must be used before its next request of the same kind and key.
+        """
+        entry = self.cache().get_or_create((kind, key), self._new,
+                                           create, key)
+        if entry[1] != values:
+            fill(entry[0], *values)
+            entry[1] = values
+        return entry[0]
+
+    @staticmethod
+    def _new(create, key):
+        return [create(*key), None]
+
+
+class requestTemplatesTest(unittest.TestCase):
+    """Check that templates are reused and only refilled on change."""
+
+    class Request:
+        def __init__(self, bank):
+            self.bank = bank
+            self.fills = 0
+
+    @staticmethod
+    def fill(request, n):
+        request.n = n
+        request.fills += 1
+
+    def test(self):
+        t = RequestTemplates(2)
+        r = t.request('acquire', ('b',), self.Request, (1,), self.fill)
+        for i in range(1000):
+            self.assertTrue(t.request('acquire', ('b',), self.Request, (1,),
+                                      self.fill) is r)
+        self.assertEqual(r.fills, 1)
+        self.assertEqual(t.request('acquire', ('b',), self.Request, (2,),
+                                   self.fill).n, 2)
+        self.assertEqual(r.fills, 2)
+        # Two other keys evict the template of 'b'.
+        for bank in ('c', 'd'):
+            t.request('acquire', (bank,), self.Request, (1,), self.fill)
+        self.assertFalse(t.request('acquire', ('b',), self.Request, (2,),
+                                   self.fill) is r)
+        self.assertEqual(t.cache().stats()['evictions'], 2)
+
+__all__ = ["LRUCache", "RequestTemplates"]
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod(verbose=True)
+    unittest.main()
@@ -0,0 +1,42 @@
+import threading
+
+def parallel_map(fn, items, workers=None):
+    """
+    Call fn on every item using one thread per item (at most workers
+    threads at once) and collect the outcome of each call.
+
+    Return a pair of dictionaries keyed by item: the results of the
+    successful calls and the exceptions raised by the failed ones.
+
+    >>> (results, errors) = parallel_map(lambda x: 10 / x, [1, 2, 0])
+    >>> sorted(results.items())
+    [(1, 10), (2, 5)]
+    >>> errors.keys()
+    [0]
+    """
+    items = list(items)
+    results = {}
+    errors = {}
+    semaphore = threading.Semaphore(workers or max(len(items), 1))
+
+    def run(item):
+        try:
+            try:
+                results[item] = fn(item)
+            except Exception, e:
+                errors[item] = e
+        finally:
+            semaphore.release()
+
+    threads = []
+    for item in items:
+        semaphore.acquire()
+        t = threading.Thread(target=run, args=(item,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join()
+    return (results, errors)
+
+__all__ = ["parallel_map"]